@@ -1,15 +1,102 @@
-import requests
 import sqlite3
 import time
 import os # <--- Make sure os is imported
+import re
+import csv
+import json
+import random
+import base64
+import hashlib
+import math
+import gzip
+import zlib
+import signal
+import sys
+import argparse
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 import platform # <--- Import platform module
 
 # --- Configuration ---
-DATABASE_FILE = "faction_data.db"  # Single DB for everything
+DATABASE_FILE = os.environ.get("TORN_TRACKER_DB", "faction_data.db")  # One DB for every faction/competition (override with --db)
 API_BASE_URL = "https://api.torn.com/user/"
-RATE_LIMIT_DELAY = 0.7
+FACTION_API_URL = "https://api.torn.com/faction/" # Roster sync (see sync_faction_roster)
+RATE_LIMIT_DELAY = 0.7 # Minimum seconds between two requests made with the SAME API key
+MAX_WORKERS = 8 # How many members are fetched in parallel (each uses their own key)
+PER_KEY_BURST = 1 # Requests a single key may fire back-to-back before pacing kicks in
+GLOBAL_RATE_LIMIT = None # Optional cap on requests/second across ALL keys (None = no cap)
 USER_AGENT = "PythonMenuCrimeTracker/1.1 (FactionOfficerTool)" # Version bump
+HTTP_POOL_SIZE = MAX_WORKERS # Keep-alive connections kept open to api.torn.com
+HTTP_TIMEOUT = 15 # Seconds before a single API request is abandoned
+HTTP_MAX_RETRIES = 3 # Retries for timeouts / connection drops / 5xx responses
+HTTP_BACKOFF_FACTOR = 0.5 # Wait 0.5s, 1s, 2s... between those retries
+UPDATE_COMMIT_BATCH = 25 # Save fetched results every N members, so an interrupted run keeps its progress
+API_MAX_RETRIES = 3 # Retries for "too many requests" and temporary Torn errors
+API_THROTTLE_BACKOFF = 2.0 # Seconds to wait after the first "too many requests", doubled on each retry
+MIN_RATE_FRACTION = 0.125 # A throttled key never slows below this fraction of its normal rate
+DB_BUSY_TIMEOUT_MS = 10000 # How long a write waits for another process (e.g. the daemon) before failing
+DB_STATEMENT_CACHE_SIZE = 256 # Prepared statements kept compiled on the shared connection
+API_KEY_PATTERN = re.compile(r'[A-Za-z0-9]{16}') # Torn API keys are 16 letters/digits
+API_CACHE_TTL = 300 # Seconds a successful API response is reused instead of fetched again (0 = off)
+API_CACHE_MAX_ENTRIES = 5000 # Oldest cached responses are evicted beyond this many
+METRICS_TEXTFILE = None # Optional path: each update run writes Prometheus-style metrics here
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Histogram buckets (seconds) for API request latency
+LOCK_FILE = DATABASE_FILE + ".lock" # Held while a scheduled (daemon) collector is running
+DAEMON_DEFAULT_INTERVAL = "15m" # How often daemon mode fetches stats
+DAEMON_JITTER_FRACTION = 0.1 # Randomly shift each daemon cycle by up to +/-10% of the interval
+VAULT_PASSPHRASE_ENV = "TORN_TRACKER_PASSPHRASE" # Unlocks encrypted API keys without a prompt (daemon, cron)
+VAULT_KDF_ITERATIONS = 600000 # PBKDF2-SHA256 rounds turning the passphrase into the master key (paid once per run)
+ENCRYPTED_KEY_PREFIX = "enc:" # Marks an encrypted value in the api_key columns
+SNAPSHOT_RAW_RETENTION = 7 * 86400 # Every snapshot is kept this long (seconds); older ones are thinned to hourly points
+SNAPSHOT_HOURLY_RETENTION = 90 * 86400 # Hourly points are kept this long; older ones are thinned to daily points
+COMPACTION_INTERVAL = 86400 # update_all_stats() compacts the history at most this often (0 = only on request)
+COMPACTION_CHUNK_ROWS = 2000 # Snapshots deleted per transaction, so the write lock is only ever held briefly
+VACUUM_CHUNK_PAGES = 1000 # Free pages returned to the file system per incremental vacuum step
+RESPONSE_JOURNAL = os.environ.get("TORN_TRACKER_JOURNAL") # Optional path: every raw API response is appended here (override with --journal)
+JOURNAL_REPLAY_BATCH = 5000 # Journal records written per transaction by replay_journal()
+SERVE_DEFAULT_HOST = "127.0.0.1" # The JSON endpoint (serve command) only listens locally unless told otherwise
+SERVE_DEFAULT_PORT = 8080
+SERVE_REFRESH_SECONDS = 2 # How often the JSON endpoint checks the database for newly committed data
+SERVE_CACHE_MAX_ENTRIES = 64 # Distinct responses the JSON endpoint keeps precomputed
+ROLLUP_TABLES = {'hour': 'crime_rollups_hourly', 'day': 'crime_rollups_daily'} # Activity rollup table per bucket size
+
+# --- Tracked Stats ---
+# Every stat the tracker knows how to read: which API selection it comes from and where it
+# sits in the response. All selections needed by TRACKED_STATS are merged into ONE request
+# per member, so tracking more stats never costs more API calls.
+StatDefinition = namedtuple('StatDefinition', 'selection path')
+STAT_REGISTRY = {
+    'crimes': StatDefinition('crimes', ('criminalrecord', 'total')),
+    'xanax_taken': StatDefinition('personalstats', ('personalstats', 'xantaken')),
+    'energy_refills': StatDefinition('personalstats', ('personalstats', 'refills')),
+    'attacks_won': StatDefinition('personalstats', ('personalstats', 'attackswon')),
+    'networth': StatDefinition('personalstats', ('personalstats', 'networth')),
+    'strength': StatDefinition('battlestats', ('strength',)),
+    'defense': StatDefinition('battlestats', ('defense',)),
+    'speed': StatDefinition('battlestats', ('speed',)),
+    'dexterity': StatDefinition('battlestats', ('dexterity',)),
+    'battlestats_total': StatDefinition('battlestats', ('total',)),
+}
+TRACKED_STATS = ('crimes',) # Add names from STAT_REGISTRY to track more. 'crimes' is always fetched.
+
+# One member's parsed response. Stats that weren't requested (or were missing) are None.
+MemberStats = namedtuple('MemberStats', STAT_REGISTRY.keys(), defaults=(None,) * len(STAT_REGISTRY))
+
+# --- Torn API Error Codes ---
+# See https://www.torn.com/api.html (Errors section)
+API_ERROR_TOO_MANY_REQUESTS = 5
+API_RETRYABLE_ERRORS = {5, 15, 17} # Too many requests, temporary error, backend error
+API_QUARANTINE_ERRORS = {
+    1: "Key is empty",
+    2: "Incorrect key",
+    10: "Key owner is in federal jail",
+    13: "Key disabled due to owner inactivity",
+    16: "Access level of this key is not high enough",
+    18: "Key has been paused by the owner",
+}
+API_HALT_ERRORS = {8, 9} # IP block / API disabled: every further request would fail too
 
 # --- Clear Screen Function ---
 def clear_screen():
@@ -23,46 +110,396 @@ def clear_screen():
 
 # --- Database Functions ---
 
+_db_conn = None
+_db_conn_lock = threading.Lock()
+
 def db_connect():
-    """Establishes a connection to the SQLite database."""
+    """
+    Opens a NEW connection to the SQLite database with the tracker's settings:
+    WAL journaling (readers never block the writer), synchronous=NORMAL (no fsync per commit
+    in WAL mode, still crash-safe) and a busy_timeout so concurrent writers wait instead of
+    failing with "database is locked". Most code should use get_db() instead.
+    """
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        conn = sqlite3.connect(DATABASE_FILE, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                               cached_statements=DB_STATEMENT_CACHE_SIZE, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL") # Only takes effect on a new file (see compact_snapshots)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+        conn.execute("PRAGMA foreign_keys = ON") # Deleting a faction or member ends its faction_members rows
+        # Lets SQL compare the keys behind two encrypted values (see import_members)
+        conn.create_function('reveal_api_key', 1, reveal_api_key, deterministic=True)
         return conn
     except sqlite3.Error as e:
         print(f"\n!!! Database connection error: {e}")
         print("!!! Please ensure the script has permission to read/write in this directory.")
         exit(1)
 
-def setup_database():
-    """Creates the necessary table if it doesn't exist."""
-    if not os.path.exists(DATABASE_FILE):
+def get_db():
+    """Returns the connection shared by the whole process, opening it on first use."""
+    global _db_conn
+    with _db_conn_lock:
+        if _db_conn is None:
+            _db_conn = db_connect()
+        return _db_conn
+
+def close_db():
+    """Closes the shared connection (at exit, or before switching DATABASE_FILE)."""
+    global _db_conn
+    with _db_conn_lock:
+        if _db_conn is not None:
+            _db_conn.close()
+            _db_conn = None
+
+def set_database_file(path):
+    """Points the tracker at another database file (and its lock file) for the rest of the run."""
+    global DATABASE_FILE, LOCK_FILE
+    close_db()
+    lock_vault() # Another database has its own passphrase
+    DATABASE_FILE = path
+    LOCK_FILE = path + ".lock"
+
+def _table_columns(cursor, table):
+    """Returns the set of column names of a table."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row['name'] for row in cursor.fetchall()}
+
+def _migrate_previous_counts(cursor):
+    """
+    Moves the old two-slot previous/last crime columns into crime_snapshots.
+    The previous_* columns are cleared afterwards so the migration only ever runs once.
+    """
+    if 'previous_crime_count' not in _table_columns(cursor, 'members'):
+        return # Database was created with the snapshot schema, nothing to migrate
+    cursor.execute("""
+        INSERT OR IGNORE INTO crime_snapshots (user_id, ts, total)
+        SELECT user_id, previous_update_timestamp, previous_crime_count FROM members
+        WHERE previous_crime_count IS NOT NULL AND previous_update_timestamp IS NOT NULL
+        UNION ALL
+        SELECT user_id, last_update_timestamp, last_crime_count FROM members
+        WHERE last_crime_count IS NOT NULL AND last_update_timestamp IS NOT NULL
+    """)
+    if cursor.rowcount > 0:
+        print(f"Migrated {cursor.rowcount} stored crime counts into the snapshot history.")
+    cursor.execute("""
+        UPDATE members SET previous_crime_count = NULL, previous_update_timestamp = NULL
+        WHERE previous_crime_count IS NOT NULL OR previous_update_timestamp IS NOT NULL
+    """)
+
+def _create_schema_v0(cursor):
+    """
+    Creates (or completes) the version 0 layout: the tables as they were before PRAGMA user_version
+    was used, with ISO text timestamps. Only runs on unversioned databases; MIGRATIONS take it from there.
+    """
+    # Factions / competitions sharing this database. Members belong to at most one.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS factions (
+            faction_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            torn_faction_id INTEGER,
+            api_key TEXT,
+            last_sync_timestamp TEXT
+        )
+    """)
+    # torn_faction_id / api_key (a leader's key) link a faction to its in-game roster for syncing
+    existing_columns = _table_columns(cursor, 'factions')
+    for column, declaration in (('torn_faction_id', 'INTEGER'), ('api_key', 'TEXT'), ('last_sync_timestamp', 'TEXT')):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE factions ADD COLUMN {column} {declaration}")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_factions_torn_id ON factions (torn_faction_id)")
+    # last_crime_count / last_update_timestamp cache the newest snapshot for quick listing
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS members (
+            user_id INTEGER PRIMARY KEY,
+            api_key TEXT NOT NULL,
+            name TEXT,
+            last_crime_count INTEGER,
+            last_update_timestamp TEXT,
+            key_error_code INTEGER,
+            key_error TEXT,
+            key_error_timestamp TEXT,
+            fail_count INTEGER NOT NULL DEFAULT 0,
+            last_failure_timestamp TEXT,
+            faction_id INTEGER REFERENCES factions (faction_id) ON DELETE SET NULL,
+            left_faction_timestamp TEXT
+        )
+    """)
+    # Databases created by older versions miss the columns added since
+    existing_columns = _table_columns(cursor, 'members')
+    for column, declaration in (('key_error_code', 'INTEGER'), ('key_error', 'TEXT'), ('key_error_timestamp', 'TEXT'),
+                                ('fail_count', 'INTEGER NOT NULL DEFAULT 0'), ('last_failure_timestamp', 'TEXT'),
+                                ('faction_id', 'INTEGER REFERENCES factions (faction_id) ON DELETE SET NULL'),
+                                ('left_faction_timestamp', 'TEXT')):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE members ADD COLUMN {column} {declaration}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_last_update ON members (last_update_timestamp)")
+    # Serves every faction-scoped query: planning (stalest first), listing and leaderboards
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_faction ON members (faction_id, last_update_timestamp)")
+    # Raw successful API responses, reused for API_CACHE_TTL seconds (see load_cached_responses)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS api_cache (
+            user_id INTEGER NOT NULL,
+            selections TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            body TEXT NOT NULL,
+            PRIMARY KEY (user_id, selections)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_cache_fetched_at ON api_cache (fetched_at)")
+    # One row per update run, written by FetchMetrics.save()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fetch_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT NOT NULL,
+            duration_seconds REAL NOT NULL,
+            members_planned INTEGER NOT NULL,
+            success_count INTEGER NOT NULL,
+            fail_count INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            bytes_received INTEGER NOT NULL,
+            latency_p50_ms REAL,
+            latency_p90_ms REAL,
+            latency_p99_ms REAL,
+            latency_max_ms REAL,
+            rate_limit_wait_seconds REAL NOT NULL,
+            db_commit_seconds REAL NOT NULL,
+            error_codes TEXT
+        )
+    """)
+    # One row per successful fetch, the full history used for results
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS crime_snapshots (
+            user_id INTEGER NOT NULL,
+            ts TEXT NOT NULL,
+            total INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_crime_snapshots_user_ts
+        ON crime_snapshots (user_id, ts)
+    """)
+    # Every other tracked stat (see TRACKED_STATS), one row per stat per fetch
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stat_snapshots (
+            user_id INTEGER NOT NULL,
+            stat TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            value REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_stat_snapshots_user_stat_ts
+        ON stat_snapshots (user_id, stat, ts)
+    """)
+    # Set once a passphrase protects the API keys (see set_vault_passphrase)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vault (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            salt BLOB NOT NULL,
+            iterations INTEGER NOT NULL,
+            check_token TEXT NOT NULL
+        )
+    """)
+    # Crimes done per member per hour / per day, kept up to date by update_rollups()
+    for table in (ROLLUP_TABLES['hour'], ROLLUP_TABLES['day']):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER NOT NULL,
+                bucket_start TEXT NOT NULL,
+                crimes INTEGER NOT NULL,
+                PRIMARY KEY (user_id, bucket_start)
+            ) WITHOUT ROWID
+        """)
+    # The newest snapshot already folded into the rollups, per member
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_progress (
+            user_id INTEGER PRIMARY KEY,
+            last_ts TEXT NOT NULL,
+            last_total INTEGER NOT NULL
+        )
+    """)
+    _migrate_previous_counts(cursor)
+
+def _rebuild_table(cursor, table, create_sql, columns, indexes=(), order_by=None):
+    """
+    Recreates a table with a new definition, copying `columns` (SELECT expressions in the new
+    column order) from the old one, in `order_by` order if given. The indexes ("CREATE ... INDEX
+    name ON {table} ...") are built before the copy, so rows the new constraints or unique
+    indexes reject are dropped (the first one copied wins). The caller turns foreign keys off,
+    so dropping the old table doesn't touch the tables referencing it.
+    """
+    cursor.execute(f"CREATE TABLE {table}_new {create_sql}")
+    for index_sql in indexes:
+        index_name = re.search(r'INDEX (\w+) ON', index_sql).group(1)
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}") # The old table's index of the same name
+        cursor.execute(index_sql.format(table=f"{table}_new")) # Renamed along with the table below
+    cursor.execute(f"INSERT OR IGNORE INTO {table}_new SELECT {', '.join(columns)} FROM {table}"
+                   + (f" ORDER BY {order_by}" if order_by else ""))
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def _migrate_1_epoch_timestamps(cursor):
+    """Store every timestamp as integer Unix seconds instead of ISO text, and let members join several factions."""
+    def _epoch(column):
+        return f"CAST(strftime('%s', {column}) AS INTEGER)"
+    _rebuild_table(cursor, 'factions', """(
+            faction_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            torn_faction_id INTEGER,
+            api_key TEXT,
+            last_sync_timestamp INTEGER
+        )""", ('faction_id', 'name', 'torn_faction_id', 'api_key', _epoch('last_sync_timestamp')),
+        ("CREATE UNIQUE INDEX idx_factions_torn_id ON {table} (torn_faction_id)",))
+    # Membership moves from members.faction_id to a link table: a member can be in a faction and competitions
+    cursor.execute("""
+        CREATE TABLE faction_members (
+            faction_id INTEGER NOT NULL REFERENCES factions (faction_id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES members (user_id) ON DELETE CASCADE,
+            left_faction_timestamp INTEGER,
+            PRIMARY KEY (faction_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX idx_faction_members_user ON faction_members (user_id)")
+    cursor.execute(f"""
+        INSERT INTO faction_members (faction_id, user_id, left_faction_timestamp)
+        SELECT faction_id, user_id, {_epoch('left_faction_timestamp')} FROM members
+        WHERE faction_id IN (SELECT faction_id FROM factions)
+    """)
+    # The emptied previous_* columns of the pre-snapshot layout are left behind here
+    _rebuild_table(cursor, 'members', """(
+            user_id INTEGER PRIMARY KEY,
+            api_key TEXT NOT NULL,
+            name TEXT,
+            last_crime_count INTEGER,
+            last_update_timestamp INTEGER,
+            key_error_code INTEGER,
+            key_error TEXT,
+            key_error_timestamp INTEGER,
+            fail_count INTEGER NOT NULL DEFAULT 0,
+            last_failure_timestamp INTEGER
+        )""", ('user_id', 'api_key', 'name', 'last_crime_count', _epoch('last_update_timestamp'), 'key_error_code',
+               'key_error', _epoch('key_error_timestamp'), 'fail_count', _epoch('last_failure_timestamp')),
+        ("CREATE INDEX idx_members_last_update ON {table} (last_update_timestamp)",))
+    _rebuild_table(cursor, 'fetch_runs', """(
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at INTEGER NOT NULL,
+            finished_at INTEGER NOT NULL,
+            duration_seconds REAL NOT NULL,
+            members_planned INTEGER NOT NULL,
+            success_count INTEGER NOT NULL,
+            fail_count INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            bytes_received INTEGER NOT NULL,
+            latency_p50_ms REAL,
+            latency_p90_ms REAL,
+            latency_p99_ms REAL,
+            latency_max_ms REAL,
+            rate_limit_wait_seconds REAL NOT NULL,
+            db_commit_seconds REAL NOT NULL,
+            error_codes TEXT
+        )""", ('run_id', _epoch('started_at'), _epoch('finished_at'), 'duration_seconds', 'members_planned',
+               'success_count', 'fail_count', 'requests', 'bytes_received', 'latency_p50_ms', 'latency_p90_ms',
+               'latency_p99_ms', 'latency_max_ms', 'rate_limit_wait_seconds', 'db_commit_seconds', 'error_codes'),
+        ("CREATE INDEX idx_fetch_runs_started_at ON {table} (started_at)",))
+    _rebuild_table(cursor, 'crime_snapshots', """(
+            user_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            total INTEGER NOT NULL
+        )""", ('user_id', _epoch('ts'), 'total'),
+        ("CREATE UNIQUE INDEX idx_crime_snapshots_user_ts ON {table} (user_id, ts)",),
+        order_by='ts DESC') # Two ISO times in the same second become one: the later snapshot is kept
+    _rebuild_table(cursor, 'stat_snapshots', """(
+            user_id INTEGER NOT NULL,
+            stat TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            value REAL NOT NULL
+        )""", ('user_id', 'stat', _epoch('ts'), 'value'),
+        ("CREATE UNIQUE INDEX idx_stat_snapshots_user_stat_ts ON {table} (user_id, stat, ts)",),
+        order_by='ts DESC')
+    for table in ROLLUP_TABLES.values():
+        _rebuild_table(cursor, table, """(
+                user_id INTEGER NOT NULL,
+                bucket_start INTEGER NOT NULL,
+                crimes INTEGER NOT NULL,
+                PRIMARY KEY (user_id, bucket_start)
+            ) WITHOUT ROWID""", ('user_id', _epoch('bucket_start'), 'crimes'))
+    _rebuild_table(cursor, 'rollup_progress', """(
+            user_id INTEGER PRIMARY KEY,
+            last_ts INTEGER NOT NULL,
+            last_total INTEGER NOT NULL
+        )""", ('user_id', _epoch('last_ts'), 'last_total'))
+
+def _migrate_2_compaction_runs(cursor):
+    """Record snapshot compaction runs."""
+    cursor.execute("""
+        CREATE TABLE compaction_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ran_at INTEGER NOT NULL,
+            rows_deleted INTEGER NOT NULL,
+            bytes_freed INTEGER NOT NULL,
+            duration_seconds REAL NOT NULL,
+            raw_cutoff INTEGER NOT NULL,
+            hourly_cutoff INTEGER NOT NULL
+        )
+    """)
+
+# Schema migrations, oldest first: MIGRATIONS[n] upgrades a database from user_version n to n + 1.
+# Only ever append to this list; a released migration must not change.
+MIGRATIONS = (
+    _migrate_1_epoch_timestamps,
+    _migrate_2_compaction_runs,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def setup_database(verbose=True):
+    """
+    Creates the tables of a new database, or upgrades an older one in place: every pending
+    migration runs in ONE transaction, so an interrupted upgrade leaves the database untouched.
+    The schema version is kept in PRAGMA user_version. Returns True if the schema is at
+    SCHEMA_VERSION, False if setting it up or upgrading it failed.
+    """
+    if verbose and not os.path.exists(DATABASE_FILE):
         print(f"Database file '{DATABASE_FILE}' not found, creating...")
-    conn = db_connect()
+    conn = get_db()
     cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    is_new = cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0] == 0
+    if version > SCHEMA_VERSION:
+        print(f"\n!!! Database '{DATABASE_FILE}' was created by a newer version of the tracker (schema {version}, "
+              f"this version knows up to {SCHEMA_VERSION}). Please update the tracker.")
+        exit(1)
+    conn.execute("PRAGMA foreign_keys = OFF") # Migrations rebuild tables; can't be changed inside the transaction
     try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS members (
-                user_id INTEGER PRIMARY KEY,
-                api_key TEXT NOT NULL,
-                name TEXT,
-                last_crime_count INTEGER,
-                last_update_timestamp TEXT,
-                previous_crime_count INTEGER,
-                previous_update_timestamp TEXT
-            )
-        """)
+        cursor.execute("BEGIN IMMEDIATE")
+        if version == 0:
+            _create_schema_v0(cursor)
+        for index in range(version, SCHEMA_VERSION):
+            if verbose and not is_new:
+                print(f"Upgrading the database to version {index + 1}: {MIGRATIONS[index].__doc__}")
+            MIGRATIONS[index](cursor)
+        if cursor.execute("PRAGMA foreign_key_check").fetchone() is not None:
+            raise sqlite3.IntegrityError("a member refers to a faction that doesn't exist")
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
-        print(f"Database '{DATABASE_FILE}' is ready.")
+        if verbose:
+            print(f"Database '{DATABASE_FILE}' is ready.")
+        return True
     except sqlite3.Error as e:
+        conn.rollback()
         print(f"\n!!! Database setup error: {e}")
+        return False
     finally:
-        if conn:
-            conn.close()
+        conn.execute("PRAGMA foreign_keys = ON")
 
-def _add_or_update_member_db(user_id, api_key, name=None):
-    """Internal function to add/update a member in the DB."""
-    conn = db_connect()
+def _add_or_update_member_db(user_id, api_key, name=None, faction_id=None):
+    """Internal function to add/update a member in the DB. With faction_id the member is also added to that faction."""
+    if not unlock_vault():
+        return False
+    api_key = seal_api_key(api_key) # Stored encrypted once a passphrase is set
+    conn = get_db()
     cursor = conn.cursor()
     success = False
     try:
@@ -70,78 +507,939 @@ def _add_or_update_member_db(user_id, api_key, name=None):
         exists = cursor.fetchone()
 
         if exists:
+            # Saving a member clears any key quarantine: the officer has (re)checked the key
             cursor.execute("""
                 UPDATE members
-                SET api_key = ?, name = ?
+                SET api_key = ?, name = ?,
+                    key_error_code = NULL, key_error = NULL, key_error_timestamp = NULL
                 WHERE user_id = ?
             """, (api_key, name, user_id))
             print(f"\n--- Member {user_id} ('{name or 'N/A'}') updated successfully. ---")
         else:
             cursor.execute("""
-                INSERT INTO members
-                (user_id, api_key, name, last_crime_count, last_update_timestamp, previous_crime_count, previous_update_timestamp)
-                VALUES (?, ?, ?, NULL, NULL, NULL, NULL)
+                INSERT INTO members (user_id, api_key, name)
+                VALUES (?, ?, ?)
             """, (user_id, api_key, name))
             print(f"\n--- Member {user_id} ('{name or 'N/A'}') added successfully. ---")
+        if faction_id is not None:
+            cursor.execute("""
+                INSERT INTO faction_members (faction_id, user_id) VALUES (?, ?)
+                ON CONFLICT (faction_id, user_id) DO NOTHING
+            """, (faction_id, user_id))
         conn.commit()
         success = True
     except sqlite3.IntegrityError:
+         conn.rollback()
          print(f"\n!!! Error: Member with User ID {user_id} might already exist (unexpected issue).")
     except sqlite3.Error as e:
+        conn.rollback()
         print(f"\n!!! Database error adding/updating member {user_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
     return success # Indicate success/failure
 
 def _remove_member_db(user_id):
     """Internal function to remove a member from the DB."""
-    conn = db_connect()
+    conn = get_db()
     cursor = conn.cursor()
     try:
         cursor.execute("DELETE FROM members WHERE user_id = ?", (user_id,))
-        changes = conn.total_changes # Use built-in counter
+        removed = cursor.rowcount > 0
+        cursor.execute("DELETE FROM crime_snapshots WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM stat_snapshots WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM api_cache WHERE user_id = ?", (user_id,))
+        for table in ROLLUP_TABLES.values():
+            cursor.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM rollup_progress WHERE user_id = ?", (user_id,))
         conn.commit()
-        return changes > 0 # Return True if a row was deleted
+        return removed # Return True if a member row was deleted
     except sqlite3.Error as e:
+        conn.rollback()
         print(f"\n!!! Database error removing member {user_id}: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
+
+# --- API Key Vault ---
+# Once a passphrase is set, every API key (members and factions) is stored Fernet-encrypted as
+# "enc:<token>" in its api_key column. The master key is derived from the passphrase with PBKDF2
+# once per process (unlock_vault) and each stored key is decrypted at most once, into
+# _revealed_keys. An empty api_key ("no key yet") is never encrypted.
+
+_vault = None # Fernet instance while unlocked
+_revealed_keys = {} # stored value -> plain API key
+_vault_lock = threading.Lock()
+
+def _vault_row():
+    """The vault settings row, or None while API keys are stored unencrypted."""
+    cursor = get_db().cursor()
+    cursor.execute("SELECT salt, iterations, check_token FROM vault WHERE id = 1")
+    return cursor.fetchone()
+
+def vault_enabled():
+    """True if the API keys in this database are encrypted."""
+    return _vault_row() is not None
+
+def _derive_vault(passphrase, salt, iterations):
+    """Turns a passphrase into the Fernet cipher for the keys. Raises ImportError without 'cryptography'."""
+    # Imported here so databases without a passphrase never need the package
+    from cryptography.fernet import Fernet
+    master_key = hashlib.pbkdf2_hmac('sha256', passphrase.encode('utf-8'), salt, iterations)
+    return Fernet(base64.urlsafe_b64encode(master_key))
+
+def unlock_vault(passphrase=None):
+    """
+    Makes the encrypted API keys readable for the rest of the process. The passphrase comes from
+    the argument, the TORN_TRACKER_PASSPHRASE environment variable or, on a terminal, a prompt.
+    Returns True if keys can be read (always, when no passphrase has been set).
+    """
+    global _vault
+    if _vault is not None:
+        return True
+    row = _vault_row()
+    if row is None:
+        return True
+    passphrase = passphrase or os.environ.get(VAULT_PASSPHRASE_ENV)
+    if not passphrase and sys.stdin.isatty():
+        import getpass
+        passphrase = getpass.getpass("Passphrase for the API keys: ")
+    if not passphrase:
+        print(f"!!! The API keys are encrypted. Set {VAULT_PASSPHRASE_ENV} or run from a terminal to enter the passphrase.")
+        return False
+    try:
+        from cryptography.fernet import InvalidToken
+        vault = _derive_vault(passphrase, row['salt'], row['iterations'])
+    except ImportError:
+        print("!!! The 'cryptography' package is needed to read encrypted API keys (pip install -r requirements.txt).")
+        return False
+    try:
+        vault.decrypt(row['check_token'].encode('ascii'))
+    except InvalidToken:
+        print("!!! Wrong passphrase for the API keys.")
+        return False
+    with _vault_lock:
+        _vault = vault
+    return True
+
+def lock_vault():
+    """Forgets the master key and every decrypted API key."""
+    global _vault
+    with _vault_lock:
+        _vault = None
+        _revealed_keys.clear()
+
+def reveal_api_key(stored):
+    """Returns the plain API key for a stored api_key value. Raises ValueError if it can't be decrypted."""
+    if not stored or not stored.startswith(ENCRYPTED_KEY_PREFIX):
+        return stored
+    with _vault_lock:
+        api_key = _revealed_keys.get(stored)
+        if api_key is None:
+            if _vault is None:
+                raise ValueError("the API keys are encrypted and the passphrase hasn't been entered")
+            from cryptography.fernet import InvalidToken
+            try:
+                api_key = _vault.decrypt(stored[len(ENCRYPTED_KEY_PREFIX):].encode('ascii')).decode('utf-8')
+            except InvalidToken:
+                raise ValueError("stored API key could not be decrypted (damaged, or from another database)")
+            _revealed_keys[stored] = api_key
+        return api_key
+
+def seal_api_key(api_key):
+    """Returns the value to store for an API key: encrypted if a passphrase is set, unchanged otherwise."""
+    if not api_key or api_key.startswith(ENCRYPTED_KEY_PREFIX):
+        return api_key
+    with _vault_lock:
+        vault = _vault
+    if vault is None:
+        if not vault_enabled():
+            return api_key
+        raise ValueError("the API keys are encrypted and the passphrase hasn't been entered")
+    stored = ENCRYPTED_KEY_PREFIX + vault.encrypt(api_key.encode('utf-8')).decode('ascii')
+    with _vault_lock:
+        _revealed_keys[stored] = api_key
+    return stored
+
+def mask_api_key(stored):
+    """An API key for display: only its last 4 characters are shown."""
+    if not stored:
+        return "(none)"
+    try:
+        api_key = reveal_api_key(stored)
+    except ValueError:
+        return "(encrypted)"
+    return "*" * max(0, len(api_key) - 4) + api_key[-4:]
+
+def set_vault_passphrase(passphrase):
+    """
+    Encrypts every stored API key under a new passphrase: the first time one is set, or to change
+    it (the current one must be unlocked). Everything is rewritten in one transaction, then the
+    database is vacuumed so no unencrypted copy is left in free pages or the WAL.
+    Returns True on success.
+    """
+    global _vault
+    if not unlock_vault():
+        return False
+    salt = os.urandom(16)
+    try:
+        new_vault = _derive_vault(passphrase, salt, VAULT_KDF_ITERATIONS)
+    except ImportError:
+        print("!!! The 'cryptography' package is needed to encrypt API keys (pip install -r requirements.txt).")
+        return False
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT user_id, api_key FROM members WHERE api_key != ''")
+        members = cursor.fetchall()
+        cursor.execute("SELECT faction_id, api_key FROM factions WHERE api_key IS NOT NULL AND api_key != ''")
+        factions = cursor.fetchall()
+        def _encrypt(stored):
+            return ENCRYPTED_KEY_PREFIX + new_vault.encrypt(reveal_api_key(stored).encode('utf-8')).decode('ascii')
+        cursor.executemany("UPDATE members SET api_key = ? WHERE user_id = ?",
+                           [(_encrypt(row['api_key']), row['user_id']) for row in members])
+        cursor.executemany("UPDATE factions SET api_key = ? WHERE faction_id = ?",
+                           [(_encrypt(row['api_key']), row['faction_id']) for row in factions])
+        cursor.execute("INSERT OR REPLACE INTO vault (id, salt, iterations, check_token) VALUES (1, ?, ?, ?)",
+                       (salt, VAULT_KDF_ITERATIONS, new_vault.encrypt(b'torn-tracker-vault').decode('ascii')))
+        conn.commit()
+    except (sqlite3.Error, ValueError) as e:
+        conn.rollback()
+        print(f"\n!!! Could not encrypt the API keys, nothing was changed: {e}")
+        return False
+    with _vault_lock:
+        _vault = new_vault
+        _revealed_keys.clear()
+    try:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.Error as e:
+        print(f"!!! Keys are encrypted, but old copies may remain in the database file until it is vacuumed: {e}")
+    print(f"\n--- {len(members)} member keys and {len(factions)} faction keys are now encrypted. ---")
+    return True
+
+def _ask_new_passphrase():
+    """Prompts (hidden) for a new passphrase twice. Returns it, or None if cancelled or the two differ."""
+    import getpass
+    passphrase = getpass.getpass("New passphrase (at least 8 characters, Enter to cancel): ")
+    if not passphrase:
+        return None
+    if len(passphrase) < 8:
+        print("!!! The passphrase must be at least 8 characters.")
+        return None
+    if getpass.getpass("Repeat the new passphrase: ") != passphrase:
+        print("!!! The passphrases don't match.")
+        return None
+    return passphrase
+
+def vault_interactive():
+    """Sets or changes the passphrase that encrypts the stored API keys."""
+    print("\n--- API Key Passphrase ---")
+    if vault_enabled():
+        print("API keys are encrypted. Enter a new passphrase to change it.")
+        if not unlock_vault():
+            return
+    else:
+        print("API keys are currently stored UNENCRYPTED in the database. Set a passphrase to encrypt them.")
+        print(f"It is asked for once per run when keys are needed (or set the {VAULT_PASSPHRASE_ENV} environment variable).")
+        print("!!! There is no way to recover the keys if the passphrase is lost.")
+    passphrase = _ask_new_passphrase()
+    if passphrase:
+        set_vault_passphrase(passphrase)
+    else:
+        print("\n--- Operation cancelled. ---")
+
+# --- Factions / Competitions ---
+# Every scoped function takes faction_id=None meaning "all factions". A member can be in several
+# factions and competitions at once: membership lives in faction_members, one row per pair, with
+# the time the member left that faction (roster sync). Scoped queries filter with _IN_FACTION_SQL,
+# a lookup on the table's (faction_id, user_id) primary key.
+
+# Members `m` of the faction bound as :faction_id
+_IN_FACTION_SQL = "m.user_id IN (SELECT user_id FROM faction_members WHERE faction_id = :faction_id)"
+
+def _left_faction_sql(faction_id):
+    """
+    SQL for when member `m` left: the faction bound as :faction_id, or with faction_id None every
+    faction they are in (NULL while they are still in one of them, or in none).
+    """
+    if faction_id is not None:
+        return ("(SELECT fm.left_faction_timestamp FROM faction_members fm "
+                "WHERE fm.faction_id = :faction_id AND fm.user_id = m.user_id)")
+    return ("(SELECT MAX(fm.left_faction_timestamp) FROM faction_members fm WHERE fm.user_id = m.user_id "
+            "HAVING COUNT(fm.left_faction_timestamp) = COUNT(*))")
+
+def find_faction(name_or_id):
+    """Returns the faction_id for a faction name (case-insensitive) or ID, or None if there is none."""
+    cursor = get_db().cursor()
+    text = str(name_or_id).strip()
+    if text.isdigit():
+        cursor.execute("SELECT faction_id FROM factions WHERE faction_id = ? OR name = ?", (int(text), text))
+    else:
+        cursor.execute("SELECT faction_id FROM factions WHERE name = ?", (text,))
+    row = cursor.fetchone()
+    return row['faction_id'] if row else None
+
+def faction_name(faction_id):
+    """Display name of a faction, or 'All factions' for None."""
+    if faction_id is None:
+        return "All factions"
+    cursor = get_db().cursor()
+    cursor.execute("SELECT name FROM factions WHERE faction_id = ?", (faction_id,))
+    row = cursor.fetchone()
+    return row['name'] if row else f"Faction {faction_id}"
+
+def add_faction(name):
+    """Creates a faction/competition (or finds the existing one with that name). Returns its faction_id."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO factions (name) VALUES (?) ON CONFLICT(name) DO NOTHING", (name,))
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"\n!!! Database error adding faction '{name}': {e}")
+        return None
+    return find_faction(name)
+
+def remove_faction(faction_id):
+    """Deletes a faction. Its members stay in the tracker (and in their other factions). Returns True if it existed."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM factions WHERE faction_id = ?", (faction_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"\n!!! Database error removing faction {faction_id}: {e}")
+        return False
+
+def assign_members_to_faction(user_ids, faction_id):
+    """
+    Adds members to a faction, keeping their other factions; a member marked as having left it
+    is back in. Unknown user IDs are ignored. Returns how many members are now in the faction.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO faction_members (faction_id, user_id)
+            SELECT ?, user_id FROM members WHERE user_id = ?
+            ON CONFLICT (faction_id, user_id) DO UPDATE SET left_faction_timestamp = NULL
+        """, ((faction_id, user_id) for user_id in user_ids))
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"\n!!! Database error assigning members: {e}")
+        return 0
+
+def unassign_members(user_ids, faction_id=None):
+    """Takes members out of a faction (None = out of every faction). Returns how many memberships ended."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("DELETE FROM faction_members WHERE user_id = ? AND (? IS NULL OR faction_id = ?)",
+                           ((user_id, faction_id, faction_id) for user_id in user_ids))
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"\n!!! Database error unassigning members: {e}")
+        return 0
+
+def get_factions():
+    """Returns every faction with its member count, plus the members in none as faction_id None."""
+    cursor = get_db().cursor()
+    cursor.execute("""
+        SELECT * FROM (
+            SELECT f.faction_id, f.name,
+                   (SELECT COUNT(*) FROM faction_members fm WHERE fm.faction_id = f.faction_id) AS member_count
+            FROM factions f
+            UNION ALL
+            SELECT NULL, '(Unassigned)', COUNT(*) FROM members m
+            WHERE NOT EXISTS (SELECT 1 FROM faction_members fm WHERE fm.user_id = m.user_id)
+        )
+        ORDER BY faction_id IS NULL, name COLLATE NOCASE
+    """)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+# --- HTTP Session ---
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Returns the shared HTTP session, creating it on first use."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            # Imported here so commands that never touch the network don't pay for loading requests
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry_policy = Retry(
+                total=HTTP_MAX_RETRIES,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(['GET']),
+                raise_on_status=False, # Hand the final 5xx back to raise_for_status()
+            )
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry_policy)
+            session = requests.Session()
+            session.headers.update({'User-Agent': USER_AGENT})
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+def close_http_session():
+    """Closes the shared HTTP session and its pooled connections."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
+
+def api_get(url, metrics=None):
+    """Performs a GET through the pooled session (keep-alive + retry/backoff), timing it into `metrics`."""
+    import requests
+    started = time.perf_counter()
+    try:
+        response = get_http_session().get(url, timeout=HTTP_TIMEOUT)
+    except requests.exceptions.RequestException:
+        if metrics:
+            metrics.record_request(time.perf_counter() - started, 0)
+        raise
+    if metrics:
+        metrics.record_request(time.perf_counter() - started, len(response.content))
+    return response
 
 # --- Torn API Function ---
-# (get_crime_count remains the same as before)
-def get_crime_count(user_id, api_key):
-    """Fetches the total crime count for a user from the Torn API."""
-    url = f"{API_BASE_URL}{user_id}?selections=crimes&key={api_key}"
-    headers = {'User-Agent': USER_AGENT}
+
+class ApiError(namedtuple('ApiError', 'code message')):
+    """A failed API call. code is Torn's numeric error code, or None for HTTP/network/parsing problems."""
+    __slots__ = ()
+
+    def __str__(self):
+        if self.code is None:
+            return self.message
+        return f"API Error Code {self.code}: {self.message}"
+
+
+def _selections_for(stats):
+    """The comma-joined `selections` value covering every stat in `stats` (crimes always included)."""
+    return ",".join(sorted({STAT_REGISTRY[stat].selection for stat in ('crimes', *stats)}))
+
+def parse_member_stats(data, stats=None):
+    """
+    Turns one decoded API response into a MemberStats record.
+    Returns (MemberStats, None) or (None, ApiError) if Torn returned an error or no crime total.
+    """
+    stats = TRACKED_STATS if stats is None else stats
+    if 'error' in data:
+        error_info = data['error']
+        return None, ApiError(error_info.get('code'), error_info.get('error', 'Unknown API error'))
+    values = {}
+    for stat in ('crimes', *stats):
+        value = data
+        for key in STAT_REGISTRY[stat].path:
+            value = value.get(key) if isinstance(value, dict) else None
+        values[stat] = value
+    if values['crimes'] is None:
+        return None, ApiError(None, "Could not find 'criminalrecord' or 'total' field in API response.")
+    return MemberStats(**values), None
+
+def _without_key(message, api_key):
+    """`message` with `api_key` masked: requests puts the full URL, key included, into its error messages."""
+    return message.replace(api_key, mask_api_key(api_key)) if api_key else message
+
+def _request_member_stats(user_id, api_key, stats, metrics=None):
+    """
+    Does the actual request for get_member_stats().
+    Returns (MemberStats, error, raw_body); raw_body is the response text (None if nothing arrived).
+    """
+    import requests
+    url = f"{API_BASE_URL}{user_id}?selections={_selections_for(stats)}&key={api_key}"
+    raw_body = None
     try:
-        response = requests.get(url, headers=headers, timeout=15)
+        response = api_get(url, metrics)
         response.raise_for_status()
-        data = response.json()
-        if 'error' in data:
-            error_info = data['error']
-            return None, f"API Error Code {error_info.get('code', 'N/A')}: {error_info.get('error', 'Unknown API error')}"
-        criminal_record = data.get('criminalrecord')
-        if criminal_record and 'total' in criminal_record:
-            return criminal_record['total'], None
-        else:
-            return None, "Could not find 'criminalrecord' or 'total' field in API response."
+        raw_body = response.text
+        member_stats, error = parse_member_stats(json.loads(raw_body), stats)
+        return member_stats, error, raw_body
     except requests.exceptions.Timeout:
-        return None, "Request timed out."
+        return None, ApiError(None, "Request timed out."), raw_body
     except requests.exceptions.RequestException as e:
-        return None, f"HTTP Request failed: {e}"
+        return None, ApiError(None, _without_key(f"HTTP Request failed: {e}", api_key)), raw_body
     except json.JSONDecodeError:
-        return None, "Failed to parse JSON response from API."
+        return None, ApiError(None, "Failed to parse JSON response from API."), raw_body
     except Exception as e:
-        return None, f"An unexpected error occurred during API call: {e}"
+        return None, ApiError(None, _without_key(f"An unexpected error occurred during API call: {e}", api_key)), raw_body
+
+def get_member_stats(user_id, api_key, stats=None, metrics=None):
+    """
+    Fetches every tracked stat for a user in a single API request.
+    Returns (MemberStats, None) or (None, ApiError).
+    """
+    stats = TRACKED_STATS if stats is None else stats
+    member_stats, error, _raw_body = _request_member_stats(user_id, api_key, stats, metrics)
+    return member_stats, error
+
+def get_crime_count(user_id, api_key, metrics=None):
+    """Fetches the total crime count for a user from the Torn API. Returns (count, None) or (None, ApiError)."""
+    member_stats, error = get_member_stats(user_id, api_key, stats=(), metrics=metrics)
+    return (member_stats.crimes if member_stats else None), error
+
+
+# --- Response Cache ---
+# Successful responses are kept in api_cache keyed on (user_id, selections). Fetched_at is a
+# Unix timestamp so TTL checks are a plain numeric comparison.
+
+def load_cached_responses(user_ids, selections, ttl=None):
+    """Returns {user_id: body} for the given members' cached responses younger than the TTL."""
+    ttl = API_CACHE_TTL if ttl is None else ttl
+    if not ttl or not user_ids:
+        return {}
+    wanted = set(user_ids)
+    cursor = get_db().cursor()
+    cursor.execute("SELECT user_id, body FROM api_cache WHERE selections = ? AND fetched_at >= ?",
+                   (selections, time.time() - ttl))
+    return {row['user_id']: row['body'] for row in cursor if row['user_id'] in wanted}
+
+def prune_response_cache(ttl=None, max_entries=None):
+    """Deletes expired responses, then the oldest ones beyond max_entries. Returns rows deleted."""
+    ttl = API_CACHE_TTL if ttl is None else ttl
+    max_entries = API_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM api_cache WHERE fetched_at < ?", (time.time() - (ttl or 0),))
+        deleted = cursor.rowcount
+        cursor.execute("""
+            DELETE FROM api_cache WHERE rowid IN (
+                SELECT rowid FROM api_cache ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)
+        """, (max_entries,))
+        deleted += cursor.rowcount
+        conn.commit()
+        return deleted
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"!!! Could not prune the response cache: {e}")
+        return 0
+
+
+# --- Raw Response Journal ---
+# With RESPONSE_JOURNAL set, every response an update run receives is appended to that file as one
+# JSON line {"user_id", "fetched_at", "selections", "body"}, the body exactly as Torn sent it.
+# The file is gzip-compressed (zstd for a path ending in .zst). Every flush() appends the records
+# since the last one as a complete, checksummed gzip member (zstd frame), and the file is never
+# rewritten. A process killed mid-write leaves at most one cut-off member behind: reading skips
+# it and carries on at the next member header, so later runs appending to the file lose nothing.
+# replay_journal() feeds it back through parse_member_stats() without any API request.
+
+JournalRecord = namedtuple('JournalRecord', 'user_id fetched_at selections body')
+JournalFormat = namedtuple('JournalFormat', 'magic compress decompressor errors')
+
+def _journal_format(path):
+    """
+    The JournalFormat for a journal path: zstd for .zst, which needs the optional 'zstandard'
+    package, gzip otherwise.
+    """
+    if not path.endswith('.zst'):
+        return JournalFormat(b'\x1f\x8b\x08', gzip.compress, lambda: zlib.decompressobj(zlib.MAX_WBITS | 16),
+                             (zlib.error,))
+    try:
+        import zstandard
+    except ImportError:
+        raise OSError("a .zst journal needs the 'zstandard' package (pip install zstandard), or use a .gz path")
+    return JournalFormat(b'\x28\xb5\x2f\xfd', zstandard.ZstdCompressor(write_checksum=True).compress,
+                         zstandard.ZstdDecompressor().decompressobj, (zstandard.ZstdError,))
+
+class ResponseJournal:
+    """Appends raw API responses to a journal file. Close it (or use `with`) to write the last records."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records_written = 0
+        self._format = _journal_format(path)
+        self._file = open(path, 'ab')
+        self._pending = []
+
+    def append(self, user_id, fetched_at, selections, body):
+        """Adds one response. fetched_at is the Unix time its snapshot is stored under."""
+        self._pending.append(json.dumps({'user_id': user_id, 'fetched_at': fetched_at,
+                                         'selections': selections, 'body': body}, separators=(',', ':')) + '\n')
+        self.records_written += 1
+
+    def flush(self):
+        """Writes the records appended since the last flush as one complete member, so they survive a crash."""
+        if not self._pending:
+            return
+        self._file.write(self._format.compress(''.join(self._pending).encode('utf-8')))
+        self._file.flush()
+        self._pending.clear()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _journal_members(journal_file, journal_format):
+    """
+    Yields the decompressed content of every intact member in an open (binary) journal file.
+    Bytes that aren't part of one, like a member cut off by a crash, are skipped with a warning.
+    """
+    buffer = bytearray()
+    buffer_offset = 0 # File offset of buffer[0]
+    damaged_from = None # File offset where the bytes being skipped start
+
+    def _read_more():
+        chunk = journal_file.read(65536)
+        buffer.extend(chunk)
+        return bool(chunk)
+
+    def _skip(count):
+        nonlocal buffer_offset, damaged_from
+        if count:
+            damaged_from = buffer_offset if damaged_from is None else damaged_from
+            del buffer[:count]
+            buffer_offset += count
+
+    def _report_damage():
+        nonlocal damaged_from
+        if damaged_from is not None:
+            print(f"!!! Skipped {buffer_offset - damaged_from} damaged bytes of the journal at offset "
+                  f"{damaged_from} (a run cut off mid-write?).")
+            damaged_from = None
+
+    while True:
+        start = buffer.find(journal_format.magic)
+        while start < 0:
+            _skip(max(0, len(buffer) - len(journal_format.magic) + 1)) # Keep a header split across reads
+            if not _read_more():
+                _skip(len(buffer))
+                _report_damage()
+                return
+            start = buffer.find(journal_format.magic)
+        _skip(start)
+        decompressor = journal_format.decompressor()
+        output = []
+        consumed = 0
+        try:
+            while not decompressor.eof and (consumed < len(buffer) or _read_more()):
+                output.append(decompressor.decompress(bytes(buffer[consumed:])))
+                consumed = len(buffer)
+        except journal_format.errors:
+            pass
+        if not decompressor.eof: # Damaged or cut off: look for the next header after this one
+            _skip(1)
+            continue
+        _report_damage()
+        member_length = consumed - len(decompressor.unused_data)
+        del buffer[:member_length]
+        buffer_offset += member_length
+        yield b''.join(output)
+
+def iter_journal(path):
+    """
+    Yields a JournalRecord per journal line, streaming the file one compressed member at a time.
+    Damaged members are skipped (see _journal_members). Raises OSError if the file can't be read.
+    """
+    journal_format = _journal_format(path)
+    with open(path, 'rb') as journal_file:
+        for content in _journal_members(journal_file, journal_format):
+            for line in content.decode('utf-8').splitlines():
+                record = json.loads(line)
+                yield JournalRecord(record['user_id'], record['fetched_at'], record['selections'], record['body'])
+
+
+# --- Fetch Metrics ---
+
+class FetchMetrics:
+    """
+    Thread-safe measurements for one update run: per-request latency, bytes received,
+    API error codes, time spent waiting on rate limits and time spent committing to the DB.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.duration = None
+        self.latencies = []
+        self.bytes_received = 0
+        self.error_codes = {} # 'code' (or 'http' for network/parsing problems) -> count
+        self.rate_limit_wait = 0.0
+        self.db_commit_time = 0.0
+        self.members_planned = 0
+        self.success_count = 0
+        self.fail_count = 0
+        self._lock = threading.Lock()
+
+    def record_request(self, seconds, size):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.bytes_received += size
+
+    def record_error(self, error):
+        key = str(error.code) if error.code is not None else 'http'
+        with self._lock:
+            self.error_codes[key] = self.error_codes.get(key, 0) + 1
+
+    def record_rate_wait(self, seconds):
+        with self._lock:
+            self.rate_limit_wait += seconds
+
+    def record_commit(self, seconds):
+        with self._lock:
+            self.db_commit_time += seconds
+
+    def finish(self, members_planned, success_count, fail_count):
+        """Stops the run clock and stores the final counts."""
+        self.duration = time.perf_counter() - self._started
+        self.members_planned = members_planned
+        self.success_count = success_count
+        self.fail_count = fail_count
+
+    def percentile(self, fraction):
+        """Latency (seconds) at the given fraction (0.5 = median), nearest-rank method. None if no requests."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self):
+        """One-line human readable summary."""
+        if not self.latencies:
+            return "No API requests were made."
+        p50, p90, p99 = (self.percentile(f) * 1000 for f in (0.5, 0.9, 0.99))
+        errors = ", ".join(f"{code}: {count}" for code, count in sorted(self.error_codes.items())) or "none"
+        return (f"Requests: {len(self.latencies)}, latency p50/p90/p99: {p50:.0f}/{p90:.0f}/{p99:.0f} ms, "
+                f"received {self.bytes_received / 1024:.1f} KiB, rate-limit waits {self.rate_limit_wait:.1f}s, "
+                f"DB commits {self.db_commit_time:.2f}s, errors by code: {errors}")
+
+    def save(self, conn):
+        """Stores the run as a fetch_runs row."""
+        def _ms(fraction):
+            value = self.percentile(fraction)
+            return value * 1000 if value is not None else None
+        conn.execute("""
+            INSERT INTO fetch_runs (started_at, finished_at, duration_seconds, members_planned, success_count,
+                                    fail_count, requests, bytes_received, latency_p50_ms, latency_p90_ms,
+                                    latency_p99_ms, latency_max_ms, rate_limit_wait_seconds, db_commit_seconds,
+                                    error_codes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (int(self.started_at.timestamp()), int(time.time()), self.duration,
+              self.members_planned, self.success_count, self.fail_count, len(self.latencies), self.bytes_received,
+              _ms(0.5), _ms(0.9), _ms(0.99), max(self.latencies) * 1000 if self.latencies else None,
+              self.rate_limit_wait, self.db_commit_time, json.dumps(self.error_codes)))
+        conn.commit()
+
+    def to_prometheus(self):
+        """Renders the run in the Prometheus text exposition format."""
+        lines = [
+            "# HELP torn_tracker_request_latency_seconds Torn API request latency.",
+            "# TYPE torn_tracker_request_latency_seconds histogram",
+        ]
+        for bound in LATENCY_BUCKETS:
+            count = sum(1 for latency in self.latencies if latency <= bound)
+            lines.append(f'torn_tracker_request_latency_seconds_bucket{{le="{bound}"}} {count}')
+        lines.append(f'torn_tracker_request_latency_seconds_bucket{{le="+Inf"}} {len(self.latencies)}')
+        lines.append(f"torn_tracker_request_latency_seconds_sum {sum(self.latencies):.6f}")
+        lines.append(f"torn_tracker_request_latency_seconds_count {len(self.latencies)}")
+        lines.append("# HELP torn_tracker_api_errors Torn API errors in the last run, by error code.")
+        lines.append("# TYPE torn_tracker_api_errors gauge")
+        for code, count in sorted(self.error_codes.items()):
+            lines.append(f'torn_tracker_api_errors{{code="{code}"}} {count}')
+        gauges = (
+            ("bytes_received", "Bytes received from the API in the last run.", self.bytes_received),
+            ("rate_limit_wait_seconds", "Seconds spent waiting on rate limits in the last run.", self.rate_limit_wait),
+            ("db_commit_seconds", "Seconds spent committing results in the last run.", self.db_commit_time),
+            ("run_duration_seconds", "Wall time of the last run.", self.duration or 0.0),
+            ("members_success", "Members fetched successfully in the last run.", self.success_count),
+            ("members_failed", "Members that failed in the last run.", self.fail_count),
+            ("last_run_timestamp_seconds", "Unix time the last run started.", self.started_at.timestamp()),
+        )
+        for name, help_text, value in gauges:
+            lines.append(f"# HELP torn_tracker_{name} {help_text}")
+            lines.append(f"# TYPE torn_tracker_{name} gauge")
+            lines.append(f"torn_tracker_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Writes the metrics file atomically so a scraper never reads half a file."""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+
+# --- Rate Limiting / Concurrent Fetching ---
+
+class TokenBucket:
+    """Thread-safe token bucket: refills `rate` tokens per second, holds at most `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+            waited += wait_time
+
+    def set_rate(self, rate):
+        """Changes the refill rate; tokens already earned are kept."""
+        with self._lock:
+            self.rate = float(rate)
+
+
+class RateLimiter:
+    """
+    Hands out request slots: one token bucket per API key, plus an optional global bucket.
+    It also tracks each key's state from the Torn error codes it sees:
+      - "too many requests" halves that key's rate, every success wins a little of it back
+      - quarantine errors (invalid/paused/... key) mark the key dead for the rest of the run
+      - halt errors (IP block, API disabled) stop all further requests
+    """
+
+    def __init__(self, per_key_delay=RATE_LIMIT_DELAY, per_key_burst=PER_KEY_BURST, global_rate=GLOBAL_RATE_LIMIT):
+        self.per_key_rate = 1.0 / per_key_delay if per_key_delay > 0 else float('inf')
+        # What a throttled key is slowed from and recovers towards; unpaced keys get 10/s once Torn pushes back
+        self.throttle_base_rate = self.per_key_rate if per_key_delay > 0 else 10.0
+        self.per_key_burst = per_key_burst
+        self.global_bucket = TokenBucket(global_rate, capacity=max(1, global_rate)) if global_rate else None
+        self._buckets = {}
+        self._dead_keys = {} # api_key -> ApiError that killed it
+        self.halt_error = None
+        self._lock = threading.Lock()
+
+    def _bucket_for(self, api_key):
+        with self._lock:
+            bucket = self._buckets.get(api_key)
+            if bucket is None:
+                bucket = TokenBucket(self.per_key_rate, self.per_key_burst)
+                self._buckets[api_key] = bucket
+            return bucket
+
+    def acquire(self, api_key):
+        """Waits until `api_key` (and the global cap, if any) may send a request."""
+        waited = 0.0
+        bucket = self._bucket_for(api_key)
+        if bucket.rate != float('inf'): # The key's own rate: an unpaced key is paced after a throttle
+            waited += bucket.acquire()
+        if self.global_bucket:
+            waited += self.global_bucket.acquire()
+        return waited
+
+    def record_success(self, api_key):
+        """Additive increase: a successful call moves a throttled key back towards its normal rate."""
+        bucket = self._bucket_for(api_key)
+        if bucket.rate < self.throttle_base_rate:
+            bucket.set_rate(min(self.throttle_base_rate, bucket.rate + self.throttle_base_rate * 0.1))
+
+    def record_throttled(self, api_key):
+        """Multiplicative decrease: Torn said "too many requests" for this key."""
+        bucket = self._bucket_for(api_key)
+        if bucket.rate == float('inf'): # Unpaced keys get a pace once Torn pushes back
+            bucket.set_rate(self.throttle_base_rate)
+        else:
+            bucket.set_rate(max(self.throttle_base_rate * MIN_RATE_FRACTION, bucket.rate / 2))
+
+    def quarantine(self, api_key, error):
+        """Marks a key as unusable; later requests with it fail immediately."""
+        with self._lock:
+            self._dead_keys[api_key] = error
+
+    def dead_key_error(self, api_key):
+        """Returns the error that quarantined this key, or None if it's usable."""
+        with self._lock:
+            return self._dead_keys.get(api_key)
+
+    def halt(self, error):
+        """Stops every further request in this run."""
+        with self._lock:
+            if self.halt_error is None:
+                self.halt_error = error
+
+
+def fetch_member_stats(members, stats=None, limiter=None, max_workers=MAX_WORKERS, metrics=None):
+    """
+    Fetches the tracked stats for many members in parallel, one request per member.
+    Yields (member, MemberStats, error, raw_body) in the SAME order as `members`, as soon as each
+    is ready. Latency, bytes, error codes and rate-limit waits go into `metrics` if given.
+    """
+    stats = TRACKED_STATS if stats is None else stats
+    limiter = limiter or RateLimiter()
+
+    def _fetch(member):
+        api_key = member['api_key']
+        for attempt in range(API_MAX_RETRIES + 1):
+            if limiter.halt_error:
+                return None, limiter.halt_error, None
+            dead_error = limiter.dead_key_error(api_key)
+            if dead_error:
+                return None, dead_error, None # Same key already failed for another member, don't spend a request
+            waited = limiter.acquire(api_key)
+            member_stats, error, raw_body = _request_member_stats(member['user_id'], api_key, stats, metrics)
+            code = error.code if error else None
+            if metrics:
+                metrics.record_rate_wait(waited)
+                if error:
+                    metrics.record_error(error)
+            if code in API_RETRYABLE_ERRORS and attempt < API_MAX_RETRIES:
+                if code == API_ERROR_TOO_MANY_REQUESTS:
+                    limiter.record_throttled(api_key)
+                backoff = API_THROTTLE_BACKOFF * (2 ** attempt)
+                if metrics:
+                    metrics.record_rate_wait(backoff)
+                time.sleep(backoff)
+                continue
+            if error is None:
+                limiter.record_success(api_key)
+            elif code in API_QUARANTINE_ERRORS:
+                limiter.quarantine(api_key, error)
+            elif code in API_HALT_ERRORS:
+                limiter.halt(error)
+            return member_stats, error, raw_body
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = [executor.submit(_fetch, member) for member in members]
+        for member, future in zip(members, futures):
+            try:
+                member_stats, error, raw_body = future.result()
+            except Exception as e: # _request_member_stats handles its own errors, this is a safety net
+                member_stats, error, raw_body = None, ApiError(None, f"An unexpected error occurred during API call: {e}"), None
+            yield member, member_stats, error, raw_body
+    finally:
+        # Closing the generator early (Ctrl-C, error) drops every fetch that hasn't started yet
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 # --- Core Logic / Menu Actions ---
 
-def add_member_interactive():
-    """Handles the interactive process of adding/updating a member via main menu."""
+def add_member_interactive(faction_id=None):
+    """Handles the interactive process of adding/updating a member via main menu (into faction_id, if set)."""
     print("\n--- Add/Update Faction Member ---")
     while True:
         try:
@@ -153,11 +1451,10 @@ def add_member_interactive():
             print("!!! Invalid input. User ID must be a number.")
 
     # Fetch current details if user exists, helps with placeholder text
-    conn = db_connect()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT api_key, name FROM members WHERE user_id = ?", (user_id,))
     current_member = cursor.fetchone()
-    conn.close()
 
     current_api_key = current_member['api_key'] if current_member else ""
     current_name = current_member['name'] if current_member else ""
@@ -166,11 +1463,11 @@ def add_member_interactive():
     print(f"\n--- {action_verb} details for User ID: {user_id} ---")
     if current_member:
         print(f"Current Name: {current_name or '(Not set)'}")
-        print(f"Current API Key: {current_api_key}")
+        print(f"Current API Key: {mask_api_key(current_api_key)}")
         print("(Press Enter to keep current values)")
 
     while True:
-        api_key_prompt = f"Enter API Key [{current_api_key}]: " if current_member else "Enter API Key: "
+        api_key_prompt = f"Enter API Key [{mask_api_key(current_api_key)}]: " if current_member else "Enter API Key: "
         api_key = input(api_key_prompt).strip()
         if not api_key and current_member: # Keep current if updating and input is empty
             api_key = current_api_key
@@ -188,22 +1485,23 @@ def add_member_interactive():
 
     print("\n--- Review Details ---")
     print(f"  User ID: {user_id}")
-    print(f"  API Key: {api_key}")
+    print(f"  API Key: {mask_api_key(api_key)}")
     print(f"  Name:    {name or '(Not set)'}")
+    if faction_id is not None:
+        print(f"  Faction: {faction_name(faction_id)}")
 
     confirm = input(f"Confirm {action_verb.lower()}ing this member? (yes/no): ").strip().lower()
     if confirm == 'yes':
-        _add_or_update_member_db(user_id, api_key, name)
+        _add_or_update_member_db(user_id, api_key, name, faction_id)
     else:
         print("\n--- Operation cancelled. ---")
 
 def edit_member_interactive(user_id):
     """Handles editing an existing member, called after listing."""
-    conn = db_connect()
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT api_key, name FROM members WHERE user_id = ?", (user_id,))
+    cursor.execute("SELECT api_key, name, key_error_code, key_error FROM members WHERE user_id = ?", (user_id,))
     current_member = cursor.fetchone()
-    conn.close()
 
     if not current_member:
         print(f"!!! Error: Member with ID {user_id} not found (should not happen here).")
@@ -211,14 +1509,18 @@ def edit_member_interactive(user_id):
 
     current_api_key = current_member['api_key']
     current_name = current_member['name']
+    key_quarantined = current_member['key_error_code'] is not None
 
     print(f"\n--- Editing Member ID: {user_id} ---")
     print(f"Current Name: {current_name or '(Not set)'}")
-    print(f"Current API Key: {current_api_key}")
+    print(f"Current API Key: {mask_api_key(current_api_key)}")
+    if key_quarantined:
+        print(f"!!! This key is quarantined (API Error Code {current_member['key_error_code']}: {current_member['key_error']}).")
+        print("!!! Saving, even with the same key, will include it in updates again.")
     print("(Press Enter to keep current values)")
 
     while True:
-        api_key = input(f"Enter NEW API Key [{current_api_key}]: ").strip()
+        api_key = input(f"Enter NEW API Key [{mask_api_key(current_api_key)}]: ").strip()
         if not api_key: # Keep current if empty
             api_key = current_api_key
             break
@@ -231,13 +1533,13 @@ def edit_member_interactive(user_id):
     name = name or None # Store None if empty/not set
 
     # Only proceed if something actually changed
-    if api_key == current_api_key and name == current_name:
+    if api_key == current_api_key and name == current_name and not key_quarantined:
         print("\n--- No changes detected. Operation cancelled. ---")
         return
 
     print("\n--- Review Changes ---")
     print(f"  User ID: {user_id}")
-    print(f"  API Key: {api_key}")
+    print(f"  API Key: {mask_api_key(api_key)}")
     print(f"  Name:    {name or '(Not set)'}")
 
     confirm = input("Confirm saving these changes? (yes/no): ").strip().lower()
@@ -249,11 +1551,10 @@ def edit_member_interactive(user_id):
 
 def _confirm_and_remove_member(user_id):
     """Handles confirmation and removal logic, usable from multiple places."""
-    conn = db_connect()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM members WHERE user_id = ?", (user_id,))
     member_row = cursor.fetchone()
-    conn.close()
 
     if member_row:
         member_name = member_row['name'] or 'N/A'
@@ -288,24 +1589,36 @@ def remove_member_interactive():
     _confirm_and_remove_member(user_id)
 
 
-def list_members():
-    """Lists members and provides options to edit/delete."""
-    print("\n--- Current Faction Members ---")
-    conn = db_connect()
+# Timestamps are formatted by SQLite, so listing never converts them row by row in Python
+def _list_member_columns(faction_id):
+    return f"""m.user_id, m.name, m.key_error_code, m.api_key = '' AS no_key,
+                   strftime('%Y-%m-%d %H:%M:%S', m.last_update_timestamp, 'unixepoch') AS last_update,
+                   date({_left_faction_sql(faction_id)}, 'unixepoch') AS left_faction_date"""
+
+def list_members(faction_id=None):
+    """Lists members (of one faction, if given) and provides options to edit/delete."""
+    print(f"\n--- Current Members: {faction_name(faction_id)} ---")
+    conn = get_db()
     cursor = conn.cursor()
     members_list = [] # Store fetched members for later lookup
     try:
-        cursor.execute("SELECT user_id, name, last_update_timestamp FROM members ORDER BY name COLLATE NOCASE")
+        if faction_id is None:
+            cursor.execute(f"""
+                SELECT {_list_member_columns(None)}
+                FROM members m ORDER BY m.name COLLATE NOCASE
+            """)
+        else:
+            cursor.execute(f"""
+                SELECT {_list_member_columns(faction_id)}
+                FROM members m
+                WHERE {_IN_FACTION_SQL} ORDER BY m.name COLLATE NOCASE
+            """, {'faction_id': faction_id})
         members = cursor.fetchall()
         members_list = [dict(m) for m in members] # Convert to list of dicts
 
     except sqlite3.Error as e:
         print(f"\n!!! Database error listing members: {e}")
-        if conn: conn.close()
         return # Can't proceed if fetch failed
-    finally:
-        if conn: conn.close()
-
 
     if not members_list:
         print("No members found in the database. Use 'Add Member' to add some.")
@@ -318,12 +1631,13 @@ def list_members():
         user_id = member['user_id']
         member_ids.add(user_id)
         name = member['name'] or '(No Name Set)'
-        last_update = member['last_update_timestamp'] or 'Never'
-        if last_update != 'Never':
-            try:
-                dt_obj = datetime.fromisoformat(last_update.replace('Z', '+00:00'))
-                last_update = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
-            except ValueError: pass # Keep original string if parsing fails
+        last_update = member['last_update'] or 'Never'
+        if member['key_error_code'] is not None:
+            last_update += f"  [KEY QUARANTINED: code {member['key_error_code']}]"
+        if member['no_key']:
+            last_update += "  [NO API KEY]"
+        if member['left_faction_date']:
+            last_update += f"  [LEFT FACTION {member['left_faction_date']}]"
         print(f"{user_id:<10} {name:<25} {last_update}")
     print("-" * 60)
 
@@ -358,195 +1672,1418 @@ def list_members():
             print("!!! Invalid input. Please enter a numeric User ID or press Enter.")
 
 
-# (update_all_stats remains the same as before)
-def update_all_stats():
-    """Fetches current crime stats for all members and updates the database."""
-    print("\n--- Update Crime Stats for All Members ---")
-    conn = db_connect()
+def plan_updates(older_than_seconds=None, only_failed=False, faction_id=None):
+    """
+    Picks the members an update run should fetch, most urgent first:
+    never-fetched members, then the stalest, with repeat failures ahead on ties.
+    older_than_seconds: only members whose last successful fetch is older than this.
+    only_failed: only members whose most recent fetch attempt failed.
+    faction_id: only members of that faction (default: every faction, in one plan).
+    Members with a quarantined key, without a key yet, or who left their faction (every faction
+    they are in, when not scoped) are never planned.
+    """
+    conditions = ["m.key_error_code IS NULL", f"{_left_faction_sql(faction_id)} IS NULL", "m.api_key != ''"]
+    params = {'faction_id': faction_id}
+    if faction_id is not None:
+        conditions.append(_IN_FACTION_SQL)
+    if older_than_seconds:
+        conditions.append("(m.last_update_timestamp IS NULL OR m.last_update_timestamp < :fresh_after)")
+        params['fresh_after'] = int(time.time() - older_than_seconds)
+    if only_failed:
+        conditions.append("m.fail_count > 0")
+    cursor = get_db().cursor()
+    cursor.execute(f"""
+        SELECT m.user_id, m.api_key, m.name FROM members m
+        WHERE {' AND '.join(conditions)}
+        ORDER BY m.last_update_timestamp IS NOT NULL, m.last_update_timestamp, m.fail_count DESC
+    """, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+def _write_snapshots(cursor, crime_rows, stat_rows):
+    """
+    Stores crime (user_id, ts, total) and stat (user_id, stat, ts, value) snapshots, skipping any
+    already stored, and moves each member's cached latest count forward (never back).
+    Shared by update runs and journal replay; the caller commits. Returns the snapshots added.
+    """
+    cursor.executemany("""
+        INSERT OR IGNORE INTO crime_snapshots (user_id, ts, total) VALUES (?, ?, ?)
+    """, crime_rows)
+    added = max(cursor.rowcount, 0)
+    cursor.executemany("""
+        INSERT OR IGNORE INTO stat_snapshots (user_id, stat, ts, value) VALUES (?, ?, ?, ?)
+    """, stat_rows)
+    added += max(cursor.rowcount, 0)
+    # A failure recorded after this success keeps its count
+    cursor.executemany("""
+        UPDATE members SET last_update_timestamp = :ts, last_crime_count = :total,
+               fail_count = CASE WHEN last_failure_timestamp > :ts THEN fail_count ELSE 0 END
+        WHERE user_id = :user_id AND (last_update_timestamp IS NULL OR last_update_timestamp <= :ts)
+    """, [{'user_id': user_id, 'ts': ts, 'total': total} for user_id, ts, total in crime_rows])
+    return added
+
+def update_all_stats(skip_fresh_seconds=None, only_failed=False, metrics_file=None, force=False, faction_id=None):
+    """
+    Fetches current crime stats for members and updates the database, stalest members first.
+    If skip_fresh_seconds is given, members fetched more recently than that are left alone.
+    If only_failed is True, only members whose last attempt failed are retried.
+    Members with a cached response younger than API_CACHE_TTL cost no request (and add no
+    duplicate snapshot) unless force is True.
+    With faction_id None every faction is fetched in the same pass, so members of different
+    factions sharing an API key also share that key's rate limit.
+    Results are saved every UPDATE_COMMIT_BATCH members, and whatever was fetched is saved
+    if the run is interrupted (Ctrl-C). Run metrics are stored in fetch_runs and, if
+    metrics_file (or METRICS_TEXTFILE) is set, written there in Prometheus text format.
+    Returns (success_count, fail_count).
+    """
+    print(f"\n--- Update Crime Stats: {faction_name(faction_id)} ---")
+    conn = get_db()
     cursor = conn.cursor()
+    scope_sql = "" if faction_id is None else f" WHERE {_IN_FACTION_SQL}"
     try:
-        cursor.execute("SELECT user_id, api_key, name, last_crime_count, last_update_timestamp FROM members")
-        members_to_update = cursor.fetchall()
+        cursor.execute(f"""
+            SELECT COALESCE(SUM(key_error_code IS NOT NULL), 0),
+                   COALESCE(SUM(key_error_code IS NULL AND left_at IS NOT NULL), 0),
+                   COALESCE(SUM(key_error_code IS NULL AND left_at IS NULL AND api_key = ''), 0),
+                   COALESCE(SUM(key_error_code IS NULL AND left_at IS NULL AND api_key != ''), 0)
+            FROM (SELECT m.*, {_left_faction_sql(faction_id)} AS left_at FROM members m{scope_sql})
+        """, {'faction_id': faction_id})
+        quarantined_count, departed_count, keyless_count, usable_count = cursor.fetchone()
+        if quarantined_count:
+            print(f"Skipping {quarantined_count} members with a quarantined API key (update their key to re-enable them).")
+        if departed_count:
+            print(f"Skipping {departed_count} members who left their faction.")
+        if keyless_count:
+            print(f"Skipping {keyless_count} members without an API key yet (add one with 'Add / Update Member').")
+        members = plan_updates(skip_fresh_seconds, only_failed, faction_id)
     except sqlite3.Error as e:
         print(f"\n!!! Error fetching members from database: {e}")
-        if conn: conn.close()
-        return
-    if not members_to_update:
-        print("No members found in the database to update.")
-        if conn: conn.close()
-        return
-
-    total_members = len(members_to_update)
-    print(f"Starting update for {total_members} members...")
+        return 0, 0
+    skipped_count = usable_count - len(members)
+    if skipped_count and skip_fresh_seconds:
+        print(f"Skipping {skipped_count} members fetched within the last {format_duration(skip_fresh_seconds)}"
+              f"{' or without a failed last attempt' if only_failed else ''}.")
+    elif skipped_count and only_failed:
+        print(f"Skipping {skipped_count} members whose last fetch succeeded.")
+    if not members:
+        if skipped_count:
+            print("No members need updating right now.")
+        else:
+            print("No members found in the database to update.")
+        return 0, 0
+    if not unlock_vault():
+        return 0, 0
+    try:
+        # Decrypted once per run: the fetches and the per-key rate limits below see plain keys
+        members = [dict(member, api_key=reveal_api_key(member['api_key'])) for member in members]
+    except ValueError as e:
+        print(f"\n!!! Could not read the API keys: {e}")
+        return 0, 0
+
+    total_members = len(members)
+    selections = _selections_for(TRACKED_STATS)
+    cached_stats = {}
+    if not force:
+        try:
+            cached_bodies = load_cached_responses([member['user_id'] for member in members], selections)
+        except sqlite3.Error as e:
+            print(f"!!! Could not read the response cache, fetching everyone: {e}")
+            cached_bodies = {}
+        for user_id, body in cached_bodies.items():
+            member_stats, error = parse_member_stats(json.loads(body), TRACKED_STATS)
+            if member_stats is not None:
+                cached_stats[user_id] = member_stats
+    members_to_fetch = [member for member in members if member['user_id'] not in cached_stats]
+    print(f"Starting update for {total_members} members (up to {MAX_WORKERS} at a time)...")
+    if cached_stats:
+        print(f"{len(cached_stats)} members were fetched less than {format_duration(API_CACHE_TTL)} ago, "
+              "reusing those responses (use force to refetch).")
     success_count = 0
     fail_count = 0
-    updates_to_commit = []
-    conn.close() # Close connection before long loop
-
-    for i, member_data in enumerate(members_to_update):
-        member = dict(member_data) # Work with dict copy
-        user_id = member['user_id']
-        api_key = member['api_key']
-        member_name = member['name'] or f"User {user_id}"
-        current_last_count = member['last_crime_count']
-        current_last_timestamp = member['last_update_timestamp']
-
-        print(f"({i+1}/{total_members}) Fetching for {member_name} (ID: {user_id})... ", end="")
-        new_crime_count, error = get_crime_count(user_id, api_key)
-
-        if error:
-            print(f"Failed! Error: {error}")
-            fail_count += 1
-        elif new_crime_count is not None:
-            print(f"Success! Crimes: {new_crime_count}")
-            success_count += 1
-            now_timestamp_iso = datetime.now(timezone.utc).isoformat()
-            updates_to_commit.append({
-                'user_id': user_id,
-                'last_crime_count': new_crime_count,
-                'last_update_timestamp': now_timestamp_iso,
-                'previous_crime_count': current_last_count,
-                'previous_update_timestamp': current_last_timestamp
-            })
-        else:
-             print(f"Failed! Unknown error fetching crimes.")
-             fail_count += 1
-        if i < total_members - 1:
-            time.sleep(RATE_LIMIT_DELAY)
-
-    # --- Commit all successful updates ---
-    if updates_to_commit:
-        print("\nCommitting updates to database...")
-        conn_commit = db_connect()
-        cursor_commit = conn_commit.cursor()
+    saved_count = 0
+    metrics = FetchMetrics()
+    updates_to_commit = [] # (user_id, timestamp, crime_count)
+    stats_to_commit = [] # (user_id, stat, timestamp, value) for the other tracked stats
+    failures_to_record = [] # (timestamp, user_id)
+    quarantined_keys = [] # (code, message, timestamp, user_id) for keys Torn says are unusable
+    responses_to_cache = [] # (user_id, selections, fetched_at, body)
+    journal = None
+    if RESPONSE_JOURNAL and members_to_fetch:
+        try:
+            journal = ResponseJournal(RESPONSE_JOURNAL)
+        except OSError as e:
+            print(f"!!! Could not open the response journal '{RESPONSE_JOURNAL}', continuing without it: {e}")
+
+    def _save_progress():
+        """Writes the pending results in one transaction and empties the queues."""
+        nonlocal saved_count
+        if not (updates_to_commit or failures_to_record):
+            return
+        commit_started = time.perf_counter()
         try:
-            for update_data in updates_to_commit:
-                cursor_commit.execute("""
-                    UPDATE members SET last_crime_count = ?, last_update_timestamp = ?,
-                                        previous_crime_count = ?, previous_update_timestamp = ?
-                    WHERE user_id = ? """, (
-                    update_data['last_crime_count'], update_data['last_update_timestamp'],
-                    update_data['previous_crime_count'], update_data['previous_update_timestamp'],
-                    update_data['user_id']
-                ))
-            conn_commit.commit()
-            print("Updates committed successfully.")
+            _write_snapshots(cursor, updates_to_commit, stats_to_commit)
+            cursor.executemany("""
+                UPDATE members SET fail_count = fail_count + 1, last_failure_timestamp = ?
+                WHERE user_id = ? """, failures_to_record)
+            cursor.executemany("""
+                UPDATE members SET key_error_code = ?, key_error = ?, key_error_timestamp = ?
+                WHERE user_id = ? """, quarantined_keys)
+            cursor.executemany("""
+                INSERT OR REPLACE INTO api_cache (user_id, selections, fetched_at, body) VALUES (?, ?, ?, ?)
+            """, responses_to_cache)
+            conn.commit()
         except sqlite3.Error as e:
+            conn.rollback()
             print(f"\n!!! Database error during commit: {e}")
-            conn_commit.rollback()
+            return
+        finally:
+            metrics.record_commit(time.perf_counter() - commit_started)
+        if journal:
+            journal.flush() # The journal never lags far behind the database
+        saved_count += len(updates_to_commit)
+        updates_to_commit.clear()
+        stats_to_commit.clear()
+        failures_to_record.clear()
+        quarantined_keys.clear()
+        responses_to_cache.clear()
+
+    extra_stats = [stat for stat in TRACKED_STATS if stat != 'crimes']
+    results = fetch_member_stats(members_to_fetch, TRACKED_STATS, metrics=metrics)
+
+    def _all_results():
+        """Cache hits first (they're instant), then live fetches as they complete."""
+        for member in members:
+            if member['user_id'] in cached_stats:
+                yield member, cached_stats[member['user_id']], None, None
+        yield from results
+
+    try:
+        for i, (member, member_stats, error, raw_body) in enumerate(_all_results()):
+            user_id = member['user_id']
+            member_name = member['name'] or f"User {user_id}"
+            now_timestamp = int(time.time())
+
+            print(f"({i+1}/{total_members}) Fetching for {member_name} (ID: {user_id})... ", end="")
+            if journal and raw_body is not None:
+                journal.append(user_id, now_timestamp, selections, raw_body)
+            if member_stats is not None and raw_body is None: # Served from the response cache
+                print(f"Success! Crimes: {member_stats.crimes} (cached)")
+                success_count += 1
+            elif error:
+                if error.code in API_QUARANTINE_ERRORS:
+                    print(f"Failed! Error: {error} (key quarantined)")
+                    quarantined_keys.append((error.code, error.message, now_timestamp, user_id))
+                else:
+                    print(f"Failed! Error: {error}")
+                failures_to_record.append((now_timestamp, user_id))
+                fail_count += 1
+            elif member_stats is not None:
+                extra_values = [(stat, getattr(member_stats, stat)) for stat in extra_stats
+                                if isinstance(getattr(member_stats, stat), (int, float))]
+                extra_text = "".join(f", {stat}: {value:g}" for stat, value in extra_values)
+                print(f"Success! Crimes: {member_stats.crimes}{extra_text}")
+                success_count += 1
+                updates_to_commit.append((user_id, now_timestamp, member_stats.crimes))
+                stats_to_commit.extend((user_id, stat, now_timestamp, value) for stat, value in extra_values)
+                if API_CACHE_TTL:
+                    responses_to_cache.append((user_id, selections, time.time(), raw_body))
+            else:
+                 print(f"Failed! Unknown error fetching crimes.")
+                 failures_to_record.append((now_timestamp, user_id))
+                 fail_count += 1
+            if len(updates_to_commit) + len(failures_to_record) >= UPDATE_COMMIT_BATCH:
+                _save_progress()
+    except KeyboardInterrupt:
+        print("\n\n!!! Update interrupted. Saving the results fetched so far...")
+    finally:
+        results.close() # Cancels fetches that haven't started
+        try:
+            _save_progress()
         finally:
-            if conn_commit: conn_commit.close()
+            if journal:
+                journal.close()
+                print(f"\n{journal.records_written} responses added to the journal '{journal.path}'.")
+
+    if API_CACHE_TTL:
+        prune_response_cache()
+    if saved_count:
+        print(f"\n{saved_count} updates committed successfully.")
+        update_rollups() # Only the snapshots just saved are read
     else:
         print("\nNo successful API updates to commit.")
-
+    metrics.finish(total_members, success_count, fail_count)
+    print(metrics.summary())
+    try:
+        metrics.save(conn)
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"!!! Could not record run metrics: {e}")
+    metrics_file = metrics_file or METRICS_TEXTFILE
+    if metrics_file:
+        try:
+            metrics.write_prometheus(metrics_file)
+        except OSError as e:
+            print(f"!!! Could not write metrics file '{metrics_file}': {e}")
     print(f"\n--- Update finished. Success: {success_count}, Failed: {fail_count} ---")
+    if saved_count and compaction_due():
+        compact_snapshots() # Keeps a scheduled collector's history from growing without limit
+    return success_count, fail_count
+
+def update_stats_interactive(faction_id=None):
+    """Asks which members (of faction_id, if set) to fetch, then runs the update."""
+    print("\n--- Update Member Stats ---")
+    print(" A. All members (stalest first)")
+    print(" S. Only members not updated recently")
+    print(" F. Only members whose last fetch failed")
+    print(" R. All members, ignoring responses cached in the last few minutes")
+    choice = input("Choose A, S, F or R [A]: ").strip().lower() or 'a'
+    if choice == 'a':
+        update_all_stats(faction_id=faction_id)
+    elif choice == 'r':
+        update_all_stats(force=True, faction_id=faction_id)
+    elif choice == 's':
+        while True:
+            age_text = input("Skip members updated within the last (e.g. 30m, 2h, 1d): ").strip()
+            try:
+                update_all_stats(skip_fresh_seconds=parse_duration(age_text), faction_id=faction_id)
+                break
+            except argparse.ArgumentTypeError as e:
+                print(f"!!! {e}")
+    elif choice == 'f':
+        update_all_stats(only_failed=True, faction_id=faction_id)
+    else:
+        print("\n--- Operation cancelled. ---")
 
-
-# (show_results remains the same as before)
-def show_results():
-    """Calculates and displays the crime difference between the last two updates."""
-    print("\n--- Crime Stats Results (Since Last Update) ---")
-    conn = db_connect()
+def _parse_time_input(text):
+    """Turns 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM' (UTC) into the Unix time stored in the DB. Returns None if blank."""
+    text = text.strip()
+    if not text:
+        return None
+    dt_obj = datetime.fromisoformat(text)
+    if dt_obj.tzinfo is None:
+        dt_obj = dt_obj.replace(tzinfo=timezone.utc)
+    return int(dt_obj.timestamp())
+
+NO_END_TIME = 2 ** 53 # Upper bound for time ranges without an end
+
+# One leaderboard line (start_ts / end_ts are Unix times). rank is None for members whose count went down inside the period.
+LeaderboardRow = namedtuple('LeaderboardRow', 'rank user_id name crimes_done start_ts end_ts start_total end_total')
+
+def get_leaderboard(start=None, end=None, limit=None, faction_id=None):
+    """
+    Ranks members by crimes done between their first and last snapshot inside [start, end].
+    With no start, the period begins at each member's second-newest snapshot (i.e. "since last update").
+    Differences, ranking and the "count went down" check all happen in one SQLite query:
+    snapshots are looked up per member through the (user_id, ts) index, LAG spots any drop
+    and ROW_NUMBER ranks the result. Returns a list of LeaderboardRow tuples, ranked rows
+    first (only the top `limit` if given), followed by the unranked "count went down" rows.
+    With faction_id, only that faction's members are ranked (found through faction_members).
+    """
+    conn = get_db()
     cursor = conn.cursor()
+    cursor.row_factory = lambda _cursor, row: LeaderboardRow(*row)
+    # Filter spelled out only when scoped: an "IS NULL OR" test would stop SQLite using the index
+    member_scope = "" if faction_id is None else f"WHERE {_IN_FACTION_SQL}"
+    cursor.execute(f"""
+        WITH bounds AS (
+            SELECT m.user_id,
+                   COALESCE(:start, (
+                       SELECT x.ts FROM crime_snapshots x
+                       WHERE x.user_id = m.user_id AND x.ts <= :end
+                       ORDER BY x.ts DESC LIMIT 1 OFFSET 1)) AS from_ts
+            FROM members m
+            {member_scope}
+        ),
+        scoped AS (
+            SELECT s.user_id, s.ts, s.total,
+                   LAG(s.total) OVER (PARTITION BY s.user_id ORDER BY s.ts) AS prev_total
+            FROM bounds b
+            CROSS JOIN crime_snapshots s -- CROSS JOIN keeps members as the outer loop: one index range per member
+              ON s.user_id = b.user_id AND s.ts >= b.from_ts AND s.ts <= :end
+        ),
+        per_member AS (
+            SELECT w.user_id, w.start_ts, w.end_ts, w.drops,
+                   first.total AS start_total, last.total AS end_total
+            FROM (
+                SELECT user_id, MIN(ts) AS start_ts, MAX(ts) AS end_ts, SUM(total < prev_total) AS drops
+                FROM scoped
+                GROUP BY user_id
+                HAVING COUNT(*) >= 2
+            ) w
+            JOIN crime_snapshots first ON first.user_id = w.user_id AND first.ts = w.start_ts
+            JOIN crime_snapshots last ON last.user_id = w.user_id AND last.ts = w.end_ts
+        ),
+        ranked AS (
+            SELECT p.*, p.end_total - p.start_total AS crimes_done,
+                   CASE WHEN p.drops = 0 THEN ROW_NUMBER() OVER (
+                       PARTITION BY p.drops = 0
+                       ORDER BY p.end_total - p.start_total DESC, p.user_id) END AS rank
+            FROM per_member p
+        )
+        SELECT r.rank, r.user_id, COALESCE(m.name, 'User ' || r.user_id), r.crimes_done,
+               r.start_ts, r.end_ts, r.start_total, r.end_total
+        FROM ranked r
+        JOIN members m ON m.user_id = r.user_id
+        WHERE r.rank IS NULL OR :limit IS NULL OR r.rank <= :limit
+        ORDER BY r.rank IS NULL, r.rank, r.user_id
+    """, {'start': start, 'end': end if end is not None else NO_END_TIME, 'limit': limit, 'faction_id': faction_id})
+    return cursor.fetchall()
+
+def _short_time(timestamp, fmt):
+    """Formats a stored Unix time (UTC) for display, '?' if missing."""
+    if timestamp is None:
+        return '?'
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(fmt)
+
+def show_results(start=None, end=None, limit=None, faction_id=None):
+    """Displays the crime leaderboard between two points in time (default: the last two updates)."""
+    if start or end:
+        print(f"\n--- Crime Stats Results (Custom Period): {faction_name(faction_id)} ---")
+    else:
+        print(f"\n--- Crime Stats Results (Since Last Update): {faction_name(faction_id)} ---")
     try:
-        cursor.execute("""
-            SELECT user_id, name, last_crime_count, previous_crime_count,
-                   last_update_timestamp, previous_update_timestamp
-            FROM members
-            WHERE last_crime_count IS NOT NULL AND previous_crime_count IS NOT NULL """)
-        results_data = cursor.fetchall()
+        leaderboard = get_leaderboard(start, end, limit, faction_id)
     except sqlite3.Error as e:
         print(f"\n!!! Error fetching results from database: {e}")
-        if conn: conn.close()
         return
-    finally:
-        if conn: conn.close()
 
-    if not results_data:
-        print("\nNo members found with two consecutive valid crime counts.")
+    if not leaderboard:
+        print("\nNo members found with two valid crime counts in this period.")
         print("Please run 'Update All Stats' at least twice to see results.")
         return
 
-    calculated_diffs = []
-    skipped_members = []
-    for row_data in results_data:
-        row = dict(row_data)
-        if row['last_crime_count'] >= row['previous_crime_count']:
-            diff = row['last_crime_count'] - row['previous_crime_count']
-            calculated_diffs.append({
-                'user_id': row['user_id'], 'name': row['name'] or f"User {row['user_id']}",
-                'crimes_done': diff, 'start_time': row['previous_update_timestamp'],
-                'end_time': row['last_update_timestamp']
-            })
-        else:
-            skipped_members.append({
-                'user_id': row['user_id'], 'name': row['name'] or f"User {row['user_id']}",
-                'reason': f"End count ({row['last_crime_count']}) < Start count ({row['previous_crime_count']})"
-            })
-    if not calculated_diffs:
+    ranked = [row for row in leaderboard if row.rank is not None]
+    skipped_members = [row for row in leaderboard if row.rank is None]
+    if not ranked:
         print("\nNo valid differences could be calculated.")
-        return
-
-    calculated_diffs.sort(key=lambda x: x['crimes_done'], reverse=True)
-    try:
-        overall_start = min(datetime.fromisoformat(r['start_time'].replace('Z', '+00:00')) for r in calculated_diffs if r['start_time']) if calculated_diffs else None
-        overall_end = max(datetime.fromisoformat(r['end_time'].replace('Z', '+00:00')) for r in calculated_diffs if r['end_time']) if calculated_diffs else None
-        period_str = f"Period approx: {overall_start.strftime('%Y-%m-%d %H:%M') if overall_start else '?'} to {overall_end.strftime('%Y-%m-%d %H:%M') if overall_end else '?'} UTC"
-    except Exception: period_str = "Period times unavailable."
-
-    print(f"\n{period_str}")
-    print("-" * 65)
-    print(f"{'Rank':<5} {'User ID':<10} {'Name':<25} {'Crimes Done':<12} {'Period'}")
-    print("-" * 65)
-    for i, result in enumerate(calculated_diffs):
-        start_short = datetime.fromisoformat(result['start_time'].replace('Z', '+00:00')).strftime('%m/%d %H:%M') if result['start_time'] else '?'
-        end_short = datetime.fromisoformat(result['end_time'].replace('Z', '+00:00')).strftime('%m/%d %H:%M') if result['end_time'] else '?'
-        period_user = f"{start_short}-{end_short}"
-        print(f"{i+1:<5} {result['user_id']:<10} {result['name']:<25} {result['crimes_done']:<12} {period_user}")
-    print("-" * 65)
+    else:
+        overall_start = _short_time(min(row.start_ts for row in ranked), '%Y-%m-%d %H:%M')
+        overall_end = _short_time(max(row.end_ts for row in ranked), '%Y-%m-%d %H:%M')
+        print(f"\nPeriod approx: {overall_start} to {overall_end} UTC")
+        print("-" * 65)
+        print(f"{'Rank':<5} {'User ID':<10} {'Name':<25} {'Crimes Done':<12} {'Period'}")
+        print("-" * 65)
+        for row in ranked:
+            period_user = f"{_short_time(row.start_ts, '%m/%d %H:%M')}-{_short_time(row.end_ts, '%m/%d %H:%M')}"
+            print(f"{row.rank:<5} {row.user_id:<10} {row.name:<25} {row.crimes_done:<12} {period_user}")
+        print("-" * 65)
     if skipped_members:
         print("\nNote: Some members were skipped in results calculation:")
-        for skipped in skipped_members: print(f"- {skipped['name']} (ID: {skipped['user_id']}): {skipped['reason']}")
+        for skipped in skipped_members:
+            print(f"- {skipped.name} (ID: {skipped.user_id}): Count went down during the period "
+                  f"(Start {skipped.start_total}, End {skipped.end_total})")
+
+
+def show_results_interactive(faction_id=None):
+    """Asks for an optional period, then shows the results for it."""
+    print("\n--- Show Crime Results ---")
+    print("Enter times in UTC as YYYY-MM-DD or YYYY-MM-DD HH:MM.")
+    print("Leave both empty to compare the last two updates.")
+    while True:
+        try:
+            start = _parse_time_input(input("Period start (optional): "))
+            end = _parse_time_input(input("Period end (optional, default now): "))
+            break
+        except ValueError:
+            print("!!! Invalid date/time format. Please try again.")
+    while True:
+        limit_str = input("Show top N members (optional, default all): ").strip()
+        if not limit_str:
+            limit = None
+            break
+        if limit_str.isdigit() and int(limit_str) > 0:
+            limit = int(limit_str)
+            break
+        print("!!! Please enter a positive number or press Enter.")
+    show_results(start, end, limit, faction_id)
+
+
+# --- Activity Rollups / Trends ---
+# The crimes done between two consecutive snapshots of a member are added to the hour and the
+# day of the later snapshot, in crime_rollups_hourly / crime_rollups_daily. rollup_progress
+# remembers each member's newest snapshot already counted, so every call only reads the
+# snapshots added since (through the (user_id, ts) index) and older history is never rescanned.
+# Buckets are as precise as the fetches: a member fetched once a day gets one daily bucket.
+
+_ROLLUP_BUCKET_SECONDS = {'hour': 3600, 'day': 86400} # Buckets start at whole UTC hours / days
+
+ActivityRow = namedtuple('ActivityRow', 'bucket_start user_id name crimes')
+TrendRow = namedtuple('TrendRow', 'user_id name previous current change previous_per_hour current_per_hour')
+StreakRow = namedtuple('StreakRow', 'user_id name current_streak longest_streak last_active_day')
+
+def update_rollups():
+    """
+    Folds the crime snapshots added since the last call into the hourly and daily rollups,
+    in one transaction. A drop in a member's count adds nothing. Returns the snapshots processed.
+    The caller must have committed its own changes first.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        # IMMEDIATE: a second process rolling up at the same time waits instead of counting twice
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("CREATE TEMP TABLE rollup_fresh (user_id INTEGER, ts INTEGER, total INTEGER, delta INTEGER)")
+        cursor.execute("""
+            INSERT INTO rollup_fresh (user_id, ts, total, delta)
+            SELECT s.user_id, s.ts, s.total,
+                   s.total - COALESCE(LAG(s.total) OVER (PARTITION BY s.user_id ORDER BY s.ts), p.last_total)
+            FROM members m
+            LEFT JOIN rollup_progress p ON p.user_id = m.user_id
+            CROSS JOIN crime_snapshots s ON s.user_id = m.user_id AND s.ts > COALESCE(p.last_ts, -1)
+        """)
+        processed = cursor.rowcount
+        for granularity, table in ROLLUP_TABLES.items():
+            cursor.execute(f"""
+                INSERT INTO {table} (user_id, bucket_start, crimes)
+                SELECT user_id, ts - ts % :size, SUM(MAX(delta, 0)) FROM rollup_fresh
+                WHERE delta IS NOT NULL
+                GROUP BY 1, 2
+                ON CONFLICT (user_id, bucket_start) DO UPDATE SET crimes = crimes + excluded.crimes
+            """, {'size': _ROLLUP_BUCKET_SECONDS[granularity]})
+        # MAX() makes SQLite take `total` from the same row as the newest ts
+        cursor.execute("""
+            INSERT INTO rollup_progress (user_id, last_ts, last_total)
+            SELECT user_id, MAX(ts), total FROM rollup_fresh
+            GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET last_ts = excluded.last_ts, last_total = excluded.last_total
+        """)
+        cursor.execute("DROP TABLE rollup_fresh")
+        conn.commit()
+        return processed
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"!!! Could not update the activity rollups: {e}")
+        return 0
+
+def rebuild_rollups(since=None):
+    """
+    Discards the rollups and recomputes them from the full snapshot history. Returns the snapshots processed.
+    since: {user_id: ts} to recompute only those members, from the bucket holding ts on (for snapshots
+    added behind the rollups' progress). Buckets before the hourly cutoff of the last compaction are
+    then left alone: the snapshots there are thinned to first/last per day and can't reproduce them.
+    """
+    conn = get_db()
+    if since is None:
+        try:
+            for table in ROLLUP_TABLES.values():
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("DELETE FROM rollup_progress")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"!!! Could not clear the activity rollups: {e}")
+            return 0
+        return update_rollups()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT hourly_cutoff FROM compaction_runs ORDER BY run_id DESC LIMIT 1")
+        compacted_before = (cursor.fetchone() or (0,))[0]
+        cursor.execute("CREATE TEMP TABLE rollup_redo (user_id INTEGER PRIMARY KEY, since INTEGER, start INTEGER)")
+        cursor.executemany("INSERT INTO rollup_redo (user_id, since) VALUES (?, ?)", since.items())
+        processed = 0
+        for granularity, table in ROLLUP_TABLES.items():
+            # From the bucket of `since`, but not into the compacted past unless not rolled up that far yet
+            cursor.execute("""
+                UPDATE rollup_redo SET start = MAX(since - since % :size, MIN(:compacted_before, COALESCE(
+                    (SELECT last_ts - last_ts % :size FROM rollup_progress p WHERE p.user_id = rollup_redo.user_id), 0)))
+            """, {'size': _ROLLUP_BUCKET_SECONDS[granularity], 'compacted_before': compacted_before})
+            cursor.execute(f"""
+                DELETE FROM {table} WHERE bucket_start >= (
+                    SELECT r.start FROM rollup_redo r WHERE r.user_id = {table}.user_id)
+            """)
+            # A member's first snapshot in range counts from the last one before it, as in update_rollups()
+            cursor.execute(f"""
+                INSERT INTO {table} (user_id, bucket_start, crimes)
+                SELECT user_id, ts - ts % :size, SUM(MAX(delta, 0)) FROM (
+                    SELECT s.user_id, s.ts,
+                           s.total - COALESCE(LAG(s.total) OVER (PARTITION BY s.user_id ORDER BY s.ts), (
+                               SELECT b.total FROM crime_snapshots b
+                               WHERE b.user_id = r.user_id AND b.ts < r.start ORDER BY b.ts DESC LIMIT 1)) AS delta
+                    FROM rollup_redo r
+                    CROSS JOIN crime_snapshots s ON s.user_id = r.user_id AND s.ts >= r.start
+                )
+                WHERE delta IS NOT NULL
+                GROUP BY 1, 2
+            """, {'size': _ROLLUP_BUCKET_SECONDS[granularity]})
+            cursor.execute("""
+                SELECT COUNT(*) FROM rollup_redo r CROSS JOIN crime_snapshots s
+                ON s.user_id = r.user_id AND s.ts >= r.start
+            """)
+            processed = max(processed, cursor.fetchone()[0])
+        # MAX() makes SQLite take `total` from the same row as the newest ts
+        cursor.execute("""
+            INSERT INTO rollup_progress (user_id, last_ts, last_total)
+            SELECT s.user_id, MAX(s.ts), s.total FROM rollup_redo r
+            CROSS JOIN crime_snapshots s ON s.user_id = r.user_id
+            GROUP BY s.user_id
+            ON CONFLICT (user_id) DO UPDATE SET last_ts = excluded.last_ts, last_total = excluded.last_total
+        """)
+        cursor.execute("DROP TABLE rollup_redo")
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"!!! Could not rebuild the activity rollups: {e}")
+        return 0
+    return processed + update_rollups() # Everyone else
+
+def _bucket_floor(granularity, timestamp=None):
+    """The start of the UTC hour/day containing `timestamp` (a Unix time, default now)."""
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    return timestamp - timestamp % _ROLLUP_BUCKET_SECONDS[granularity]
+
+def get_activity(granularity='day', start=None, end=None, faction_id=None, by_member=True):
+    """
+    Crimes done per bucket ('hour' or 'day') for buckets starting in [start, end) (Unix times).
+    Returns ActivityRow tuples, oldest bucket first. With by_member False the members of
+    each bucket are added up into one row (user_id None).
+    """
+    table = ROLLUP_TABLES[granularity]
+    member_scope = "" if faction_id is None else f"WHERE {_IN_FACTION_SQL}"
+    if by_member:
+        select, group = "m.user_id, COALESCE(m.name, 'User ' || m.user_id), r.crimes", ""
+    else:
+        select, group = "NULL, 'All members', SUM(r.crimes)", "GROUP BY r.bucket_start"
+    cursor = get_db().cursor()
+    cursor.row_factory = lambda _cursor, row: ActivityRow(*row)
+    cursor.execute(f"""
+        SELECT r.bucket_start, {select}
+        FROM members m
+        CROSS JOIN {table} r ON r.user_id = m.user_id AND r.bucket_start >= :start AND r.bucket_start < :end
+        {member_scope}
+        {group}
+        ORDER BY r.bucket_start{', r.crimes DESC, m.user_id' if by_member else ''}
+    """, {'start': start or 0, 'end': end if end is not None else NO_END_TIME, 'faction_id': faction_id})
+    return cursor.fetchall()
+
+def get_trends(period_seconds, end=None, faction_id=None):
+    """
+    Compares each current member's crimes in the last period (ending at the Unix time `end`,
+    default the end of the current hour) with the period before it, from the hourly rollups.
+    Returns TrendRow tuples, biggest slowdown first.
+    """
+    period_seconds = max(3600, int(period_seconds) // 3600 * 3600) # Whole hours, like the buckets
+    end_hour = _bucket_floor('hour', end - 1 if end is not None else None) + 3600
+    bounds = [end_hour - period_seconds * n for n in (2, 1, 0)]
+    member_scope = "" if faction_id is None else f"AND {_IN_FACTION_SQL}"
+    cursor = get_db().cursor()
+    cursor.row_factory = lambda _cursor, row: TrendRow(*row)
+    cursor.execute(f"""
+        SELECT user_id, name, previous, current, current - previous,
+               previous * 3600.0 / :period, current * 3600.0 / :period
+        FROM (
+            SELECT m.user_id, COALESCE(m.name, 'User ' || m.user_id) AS name,
+                   COALESCE(SUM(CASE WHEN r.bucket_start < :middle THEN r.crimes END), 0) AS previous,
+                   COALESCE(SUM(CASE WHEN r.bucket_start >= :middle THEN r.crimes END), 0) AS current
+            FROM members m
+            LEFT JOIN crime_rollups_hourly r
+              ON r.user_id = m.user_id AND r.bucket_start >= :start AND r.bucket_start < :end
+            WHERE {_left_faction_sql(faction_id)} IS NULL {member_scope}
+            GROUP BY m.user_id
+        )
+        ORDER BY current - previous, user_id
+    """, {'start': bounds[0], 'middle': bounds[1], 'end': bounds[2], 'period': period_seconds,
+          'faction_id': faction_id})
+    return cursor.fetchall()
+
+def get_streaks(faction_id=None, today=None):
+    """
+    Runs of consecutive UTC days with at least one crime, from the daily rollups.
+    The current streak counts if it reaches today or yesterday (today may not be over yet);
+    `today` is any Unix time on the day to count from (default now).
+    Returns StreakRow tuples, longest current streak first. Streaks need at least daily fetches:
+    a day without any fetch has no bucket and breaks the run.
+    """
+    member_scope = "" if faction_id is None else f"WHERE {_IN_FACTION_SQL}"
+    cursor = get_db().cursor()
+    cursor.row_factory = lambda _cursor, row: StreakRow(*row)
+    cursor.execute(f"""
+        WITH active AS (
+            SELECT r.user_id, r.bucket_start / 86400 AS day,
+                   r.bucket_start / 86400 - ROW_NUMBER() OVER (PARTITION BY r.user_id ORDER BY r.bucket_start) AS island
+            FROM members m
+            CROSS JOIN crime_rollups_daily r ON r.user_id = m.user_id AND r.crimes > 0
+            {member_scope}
+        ),
+        islands AS (
+            SELECT user_id, COUNT(*) AS length, MAX(day) AS last_day FROM active GROUP BY user_id, island
+        )
+        SELECT i.user_id, COALESCE(m.name, 'User ' || i.user_id),
+               COALESCE(MAX(CASE WHEN i.last_day >= :today - 1 THEN i.length END), 0) AS current_streak,
+               MAX(i.length) AS longest_streak, MAX(i.last_day) * 86400
+        FROM islands i
+        JOIN members m ON m.user_id = i.user_id
+        GROUP BY i.user_id
+        ORDER BY current_streak DESC, longest_streak DESC, i.user_id
+    """, {'today': _bucket_floor('day', today) // 86400, 'faction_id': faction_id})
+    return cursor.fetchall()
+
+def show_activity(granularity='day', start=None, end=None, faction_id=None, by_member=False):
+    """Prints crimes per day/hour, for the whole faction or per member."""
+    print(f"\n--- Crimes per {granularity}: {faction_name(faction_id)} ---")
+    try:
+        rows = get_activity(granularity, start, end, faction_id, by_member)
+    except sqlite3.Error as e:
+        print(f"\n!!! Error fetching activity from database: {e}")
+        return
+    if not rows:
+        print("\nNo activity recorded in this period. Run 'Update All Stats' regularly to build it up.")
+        return
+    time_format = '%Y-%m-%d' if granularity == 'day' else '%Y-%m-%d %H:00'
+    print("-" * 55)
+    print(f"{'Bucket (UTC)':<18} {'Name':<25} {'Crimes'}")
+    print("-" * 55)
+    for row in rows:
+        print(f"{_short_time(row.bucket_start, time_format):<18} {row.name:<25} {row.crimes}")
+    print("-" * 55)
+
+def show_trends(period_seconds, faction_id=None):
+    """Prints who sped up and who slowed down compared with the period before."""
+    print(f"\n--- Trends over the last {format_duration(period_seconds)}: {faction_name(faction_id)} ---")
+    try:
+        trends = get_trends(period_seconds, faction_id=faction_id)
+    except sqlite3.Error as e:
+        print(f"\n!!! Error fetching trends from database: {e}")
+        return
+    if not trends:
+        print("\nNo members found.")
+        return
+    print("-" * 75)
+    print(f"{'User ID':<10} {'Name':<25} {'Before':<8} {'Now':<8} {'Change':<8} {'Crimes/hour'}")
+    print("-" * 75)
+    for row in trends:
+        print(f"{row.user_id:<10} {row.name:<25} {row.previous:<8} {row.current:<8} {row.change:<+8} "
+              f"{row.previous_per_hour:.2f} -> {row.current_per_hour:.2f}")
+    print("-" * 75)
+
+def show_streaks(faction_id=None):
+    """Prints each member's current and longest run of active days."""
+    print(f"\n--- Activity Streaks (days in a row with crimes): {faction_name(faction_id)} ---")
+    try:
+        streaks = get_streaks(faction_id)
+    except sqlite3.Error as e:
+        print(f"\n!!! Error fetching streaks from database: {e}")
+        return
+    if not streaks:
+        print("\nNo activity recorded yet. Run 'Update All Stats' at least daily to track streaks.")
+        return
+    print("-" * 70)
+    print(f"{'User ID':<10} {'Name':<25} {'Current':<9} {'Longest':<9} {'Last Active'}")
+    print("-" * 70)
+    for row in streaks:
+        print(f"{row.user_id:<10} {row.name:<25} {row.current_streak:<9} {row.longest_streak:<9} "
+              f"{_short_time(row.last_active_day, '%Y-%m-%d')}")
+    print("-" * 70)
+
+def analytics_interactive(faction_id=None):
+    """Menu wrapper for the activity, trend and streak reports."""
+    print(f"\n--- Activity & Trends: {faction_name(faction_id)} ---")
+    print(" D. Crimes per day (last 2 weeks)")
+    print(" H. Crimes per hour (last 24 hours)")
+    print(" M. Crimes per day for each member (last week)")
+    print(" T. Who sped up / slowed down")
+    print(" S. Activity streaks")
+    choice = input("Choose D, H, M, T or S [D]: ").strip().lower() or 'd'
+    update_rollups() # Once here; the reports below only read
+    now = time.time()
+    if choice == 'd':
+        show_activity('day', _bucket_floor('day', now - 14 * 86400), faction_id=faction_id)
+    elif choice == 'h':
+        show_activity('hour', _bucket_floor('hour', now - 23 * 3600), faction_id=faction_id)
+    elif choice == 'm':
+        show_activity('day', _bucket_floor('day', now - 7 * 86400), faction_id=faction_id, by_member=True)
+    elif choice == 't':
+        while True:
+            period_text = input("Compare the last (e.g. 1d, 7d) [7d]: ").strip() or '7d'
+            try:
+                show_trends(parse_duration(period_text), faction_id)
+                break
+            except argparse.ArgumentTypeError as e:
+                print(f"!!! {e}")
+    elif choice == 's':
+        show_streaks(faction_id)
+    else:
+        print("\n--- Operation cancelled. ---")
+
+
+# --- Snapshot Retention / Compaction ---
+# Snapshots older than SNAPSHOT_RAW_RETENTION are thinned to the first and last one of each hour,
+# and those older than SNAPSHOT_HOURLY_RETENTION to the first and last one of each day. Totals only
+# ever grow, so the difference between any two points that are kept is still exact; only the
+# points in between go. The rollups are brought up to date first, so they lose nothing either.
+# Each run records the two cutoffs it reached in compaction_runs, and the next run starts there,
+# so a daily run only reads the snapshots that aged past a cutoff since, not the whole history.
+
+CompactionResult = namedtuple('CompactionResult', 'rows_deleted bytes_freed seconds')
+
+def _compactable_rowids(cursor, table, partition, start, end, bucket_seconds):
+    """
+    Rowids of the snapshots in `table` with start <= ts < end that are neither the first nor the
+    last of their bucket. start and end must be bucket-aligned, so every bucket is seen whole.
+    """
+    # CROSS JOIN keeps members as the outer loop: one (user_id, ts) index range per member
+    cursor.execute(f"""
+        SELECT row_id FROM (
+            SELECT row_id,
+                   ROW_NUMBER() OVER (PARTITION BY {partition}, ts - ts % :bucket ORDER BY ts) AS from_first,
+                   ROW_NUMBER() OVER (PARTITION BY {partition}, ts - ts % :bucket ORDER BY ts DESC) AS from_last
+            FROM (
+                SELECT s.rowid AS row_id, s.*
+                FROM members m
+                CROSS JOIN {table} s ON s.user_id = m.user_id AND s.ts >= :start AND s.ts < :end
+            )
+        )
+        WHERE from_first > 1 AND from_last > 1
+    """, {'start': start, 'end': end, 'bucket': bucket_seconds})
+    return [row[0] for row in cursor.fetchall()]
+
+def _database_pages(conn):
+    """(page_count, page_size) of the database file."""
+    return conn.execute("PRAGMA page_count").fetchone()[0], conn.execute("PRAGMA page_size").fetchone()[0]
+
+def compact_snapshots(keep_raw=None, keep_hourly=None, full=False, switch_vacuum=False):
+    """
+    Thins old crime/stat snapshots (see above), deleting COMPACTION_CHUNK_ROWS per transaction,
+    then hands the freed pages back to the file system with incremental vacuum steps and refreshes
+    the query planner statistics. The run is recorded in compaction_runs.
+    full: rescan the whole history instead of starting where the last run stopped.
+    switch_vacuum: run the one-off full VACUUM that databases created before incremental
+    vacuuming need to start returning space. It locks the database while it runs, so it only
+    ever happens on request; without it such files reuse the freed pages instead.
+    Returns a CompactionResult, or None if it failed.
+    """
+    keep_raw = SNAPSHOT_RAW_RETENTION if keep_raw is None else keep_raw
+    keep_hourly = max(keep_raw, SNAPSHOT_HOURLY_RETENTION if keep_hourly is None else keep_hourly)
+    now = int(time.time())
+    raw_cutoff = _bucket_floor('hour', now - keep_raw)
+    hourly_cutoff = _bucket_floor('day', now - keep_hourly) # Day-aligned, so no hour straddles the two zones
+    print(f"\n--- Compacting history: every snapshot of the last {format_duration(keep_raw)}, hourly points up to "
+          f"{format_duration(keep_hourly)}, daily points before that ---")
+    update_rollups()
+    started = time.perf_counter()
+    conn = get_db()
+    cursor = conn.cursor()
+    previous = None if full else cursor.execute("""
+        SELECT raw_cutoff, hourly_cutoff FROM compaction_runs ORDER BY run_id DESC LIMIT 1
+    """).fetchone()
+    raw_from, hourly_from = tuple(previous) if previous else (0, 0)
+    # Newly aged past the raw cutoff (and not yet due for daily points) -> hourly; past the hourly cutoff -> daily
+    zones = ((max(raw_from, hourly_cutoff), raw_cutoff, 3600), (hourly_from, hourly_cutoff, 86400))
+    pages_before, page_size = _database_pages(conn)
+    incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    rows_deleted = 0
+    try:
+        for table, partition in (('crime_snapshots', 'user_id'), ('stat_snapshots', 'user_id, stat')):
+            for start, end, bucket_seconds in zones:
+                if start >= end:
+                    continue
+                rowids = _compactable_rowids(cursor, table, partition, start, end, bucket_seconds)
+                for offset in range(0, len(rowids), COMPACTION_CHUNK_ROWS):
+                    cursor.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT value FROM json_each(?))",
+                                   (json.dumps(rowids[offset:offset + COMPACTION_CHUNK_ROWS]),))
+                    rows_deleted += cursor.rowcount
+                    conn.commit()
+        if not incremental and switch_vacuum:
+            print("Switching the database to incremental vacuuming (one-off, the database is locked meanwhile)...")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            incremental = True
+        if incremental:
+            while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+                # executescript() steps the pragma to completion; execute() would free a single page
+                conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_CHUNK_PAGES});")
+        conn.execute("PRAGMA analysis_limit = 1000") # Sampled ANALYZE, fast even on a big history
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages_after, _page_size = _database_pages(conn)
+        result = CompactionResult(rows_deleted, max(0, pages_before - pages_after) * page_size,
+                                  time.perf_counter() - started)
+        conn.execute("""
+            INSERT INTO compaction_runs (ran_at, rows_deleted, bytes_freed, duration_seconds, raw_cutoff, hourly_cutoff)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (now, result.rows_deleted, result.bytes_freed, result.seconds, raw_cutoff, hourly_cutoff))
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"!!! Compaction stopped after removing {rows_deleted} snapshots: {e}")
+        return None
+    print(f"Removed {result.rows_deleted} snapshots and freed {result.bytes_freed / 1048576:.1f} MiB "
+          f"in {result.seconds:.1f}s.")
+    if not incremental:
+        print("This database file was created before incremental vacuuming: the space is reused by new data, "
+              "but the file doesn't shrink. Run 'compact --vacuum' once (it locks the database while it runs) to change that.")
+    return result
+
+def compaction_due():
+    """True if COMPACTION_INTERVAL has passed since the last compaction."""
+    if not COMPACTION_INTERVAL:
+        return False
+    cursor = get_db().cursor()
+    cursor.execute("SELECT MAX(ran_at) FROM compaction_runs")
+    last_run = cursor.fetchone()[0]
+    return last_run is None or last_run <= time.time() - COMPACTION_INTERVAL
+
+
+# --- Journal Replay ---
+# Replaying a journal stores every response in it again as if it had just been fetched, at disk
+# speed and without the network. Snapshots already stored (same member, same time) are left as
+# they are, so a journal can be replayed any number of times; stats added to TRACKED_STATS since
+# the responses were fetched are filled in from them if the request included their selection.
+# Old snapshots replayed after compaction has passed them stay complete until `compact --full`.
+
+ReplayResult = namedtuple('ReplayResult', 'records snapshots_added skipped seconds')
+
+def replay_journal(path, since=None, until=None):
+    """
+    Streams the journal at `path` (records fetched between since and until, Unix times) through
+    parse_member_stats() and the snapshot writer, JOURNAL_REPLAY_BATCH records per transaction,
+    then brings the rollups up to date. Error responses and members no longer in the database
+    are skipped. Returns a ReplayResult, or None if nothing could be read or the database failed.
+    """
+    print(f"\n--- Replaying the response journal '{path}' ---")
+    started = time.perf_counter()
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id FROM members")
+    known_members = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT user_id, last_ts FROM rollup_progress")
+    rolled_up_until = dict(cursor.fetchall())
+    extra_stats = [stat for stat in TRACKED_STATS if stat != 'crimes']
+    crime_rows = [] # (user_id, timestamp, crime_count)
+    stat_rows = [] # (user_id, stat, timestamp, value)
+    records = added = skipped = 0
+    behind_rollups = {} # user_id -> oldest replayed ts the rollups had already moved past
+    try:
+        try:
+            for record in iter_journal(path):
+                if (since is not None and record.fetched_at < since) or (until is not None and record.fetched_at > until):
+                    continue
+                records += 1
+                if record.user_id not in known_members:
+                    skipped += 1
+                    continue
+                try:
+                    member_stats, _error = parse_member_stats(json.loads(record.body), TRACKED_STATS)
+                except ValueError: # The API answered with something that isn't JSON
+                    member_stats = None
+                if member_stats is None:
+                    skipped += 1
+                    continue
+                crime_rows.append((record.user_id, record.fetched_at, member_stats.crimes))
+                stat_rows.extend((record.user_id, stat, record.fetched_at, getattr(member_stats, stat))
+                                 for stat in extra_stats if isinstance(getattr(member_stats, stat), (int, float)))
+                if record.fetched_at <= rolled_up_until.get(record.user_id, -1):
+                    behind_rollups[record.user_id] = min(record.fetched_at, behind_rollups.get(record.user_id, record.fetched_at))
+                if len(crime_rows) >= JOURNAL_REPLAY_BATCH:
+                    added += _write_snapshots(cursor, crime_rows, stat_rows)
+                    conn.commit()
+                    crime_rows.clear()
+                    stat_rows.clear()
+        except FileNotFoundError:
+            print(f"!!! File not found: '{path}'")
+            return None
+        except (OSError, ValueError) as e:
+            if not records:
+                print(f"!!! Could not read the journal: {e}")
+                return None
+            print(f"!!! The journal is damaged after {records} records ({e}). Replaying the records before it.")
+        added += _write_snapshots(cursor, crime_rows, stat_rows)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"!!! Database error during replay, {added} snapshots were saved: {e}")
+        return None
+    if added and behind_rollups:
+        rebuild_rollups(behind_rollups) # Incremental rollups only look at snapshots newer than what they already counted
+    elif added:
+        update_rollups()
+    result = ReplayResult(records, added, skipped, time.perf_counter() - started)
+    rate_text = f" ({result.records / result.seconds:,.0f}/s)" if result.seconds else ""
+    print(f"Replayed {result.records} responses in {result.seconds:.1f}s{rate_text}: {result.snapshots_added} new "
+          f"snapshots, {result.skipped} skipped (error responses or members not in the database).")
+    return result
+
+
+# --- Bulk Import / Export ---
+
+ROSTER_EXPORT_FIELDS = ('user_id', 'name', 'api_key', 'last_crime_count', 'last_update_timestamp')
+
+def _roster_format(path):
+    """Picks the file format from the extension: 'csv', 'jsonl' (one object per line) or 'json'."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension == '.json':
+        return 'json'
+    raise ValueError(f"Unsupported file type '{extension}'. Use .csv, .json or .jsonl")
+
+def _iter_roster_records(path):
+    """
+    Yields (line_number, record_dict) from a roster file without loading it all at once.
+    CSV and JSON Lines are streamed row by row. A plain .json file holds a single array
+    (or {"members": [...]}), which the json module can only read in one go.
+    """
+    file_format = _roster_format(path)
+    with open(path, 'r', encoding='utf-8-sig', newline='') as roster_file: # utf-8-sig: Excel adds a BOM
+        if file_format == 'csv':
+            reader = csv.DictReader(roster_file)
+            for record in reader:
+                yield reader.line_num, record
+        elif file_format == 'jsonl':
+            for line_number, line in enumerate(roster_file, start=1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+        else:
+            data = json.load(roster_file)
+            if isinstance(data, dict):
+                data = data.get('members', [])
+            for index, record in enumerate(data, start=1):
+                yield index, record
+
+def _normalize_roster_record(record):
+    """
+    Validates one roster entry. Accepts user_id/id, api_key/key and name columns.
+    Returns (user_id, api_key, name) or raises ValueError with the reason.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("entry is not an object")
+    fields = {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+    raw_id = fields.get('user_id', fields.get('id'))
+    raw_key = fields.get('api_key', fields.get('key'))
+    try:
+        user_id = int(str(raw_id).strip())
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid User ID {raw_id!r}")
+    if user_id <= 0:
+        raise ValueError(f"invalid User ID {raw_id!r}")
+    api_key = str(raw_key).strip() if raw_key is not None else ''
+    if not API_KEY_PATTERN.fullmatch(api_key):
+        raise ValueError(f"User {user_id}: API key must be 16 letters/digits")
+    name = str(fields.get('name') or '').strip() or None
+    return user_id, api_key, name
+
+def import_members(path, faction_id=None):
+    """
+    Adds/updates every member in a CSV/JSON roster in ONE transaction using a batched upsert.
+    With faction_id, every imported member is also added to that faction.
+    Invalid rows and repeated User IDs (first one wins) are skipped and reported.
+    Returns True if the import was committed.
+    """
+    print(f"\n--- Importing members from '{path}' ---")
+    errors = [] # (line, reason)
+    duplicates = [] # (line, user_id)
+    seen_ids = set()
+    valid_count = 0
+
+    def _valid_rows():
+        nonlocal valid_count
+        for line_number, record in _iter_roster_records(path):
+            try:
+                row = _normalize_roster_record(record)
+            except ValueError as e:
+                errors.append((line_number, str(e)))
+                continue
+            if row[0] in seen_ids:
+                duplicates.append((line_number, row[0]))
+                continue
+            seen_ids.add(row[0])
+            valid_count += 1
+            yield (row[0], seal_api_key(row[1]), row[2])
+
+    if not unlock_vault():
+        print("!!! Nothing was imported.")
+        return False
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM members")
+        members_before = cursor.fetchone()[0]
+        # A changed key lifts any quarantine; re-importing the same key keeps it (compared decrypted)
+        cursor.executemany("""
+            INSERT INTO members (user_id, api_key, name) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                name = COALESCE(excluded.name, members.name),
+                key_error_code = CASE WHEN reveal_api_key(excluded.api_key) = reveal_api_key(members.api_key) THEN members.key_error_code END,
+                key_error = CASE WHEN reveal_api_key(excluded.api_key) = reveal_api_key(members.api_key) THEN members.key_error END,
+                key_error_timestamp = CASE WHEN reveal_api_key(excluded.api_key) = reveal_api_key(members.api_key) THEN members.key_error_timestamp END,
+                api_key = excluded.api_key
+        """, _valid_rows())
+        if faction_id is not None:
+            cursor.execute("""
+                INSERT INTO faction_members (faction_id, user_id)
+                SELECT ?, value FROM json_each(?) WHERE true
+                ON CONFLICT (faction_id, user_id) DO NOTHING
+            """, (faction_id, json.dumps(sorted(seen_ids))))
+        cursor.execute("SELECT COUNT(*) FROM members")
+        added_count = cursor.fetchone()[0] - members_before
+        conn.commit()
+    except (OSError, ValueError, csv.Error) as e: # json.JSONDecodeError is a ValueError
+        conn.rollback()
+        print(f"\n!!! Could not read '{path}': {e}")
+        print("!!! Nothing was imported.")
+        return False
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"\n!!! Database error during import: {e}")
+        print("!!! Nothing was imported.")
+        return False
+
+    print(f"Imported {valid_count} members ({added_count} new, {valid_count - added_count} updated).")
+    if duplicates:
+        print(f"\nSkipped {len(duplicates)} duplicate entries (the first entry for each User ID was used):")
+        for line_number, user_id in duplicates:
+            print(f"- Entry {line_number}: User ID {user_id}")
+    if errors:
+        print(f"\nSkipped {len(errors)} invalid entries:")
+        for line_number, reason in errors:
+            print(f"- Entry {line_number}: {reason}")
+    return True
+
+def export_members(path, include_keys=True, faction_id=None):
+    """
+    Streams the member table (one faction's members, if given) to a CSV/JSON file. Returns the
+    number written, or None if the API keys are encrypted and the vault couldn't be unlocked.
+    """
+    file_format = _roster_format(path)
+    fields = ROSTER_EXPORT_FIELDS if include_keys else tuple(f for f in ROSTER_EXPORT_FIELDS if f != 'api_key')
+    if include_keys and not unlock_vault(): # unlock_vault() has said why
+        return None
+    columns = ', '.join('reveal_api_key(api_key)' if field == 'api_key' else field for field in fields) # Files get plain keys
+    conn = get_db()
+    cursor = conn.cursor()
+    if faction_id is None:
+        cursor.execute(f"SELECT {columns} FROM members ORDER BY user_id")
+    else:
+        cursor.execute(f"SELECT {columns} FROM members m WHERE {_IN_FACTION_SQL} ORDER BY user_id",
+                       {'faction_id': faction_id})
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as out_file:
+        if file_format == 'csv':
+            writer = csv.writer(out_file)
+            writer.writerow(fields)
+            for row in cursor:
+                writer.writerow(tuple(row))
+                count += 1
+        else:
+            if file_format == 'json':
+                out_file.write('[\n')
+            for row in cursor:
+                if file_format == 'json' and count:
+                    out_file.write(',\n')
+                out_file.write(json.dumps(dict(zip(fields, row))))
+                if file_format == 'jsonl':
+                    out_file.write('\n')
+                count += 1
+            if file_format == 'json':
+                out_file.write('\n]\n')
+    return count
+
+def import_export_interactive(faction_id=None):
+    """Menu wrapper for bulk roster import and export (into / out of faction_id, if set)."""
+    print(f"\n--- Import / Export Members: {faction_name(faction_id)} ---")
+    print("Files can be .csv (columns: user_id, api_key, name), .json or .jsonl.")
+    choice = input("(I)mport a roster, (E)xport the members, or (C)ancel? ").strip().lower()
+    if choice == 'i':
+        path = input("Path of the file to import: ").strip().strip('"')
+        if not path:
+            print("\n--- Operation cancelled. ---")
+        elif not os.path.isfile(path):
+            print(f"\n!!! File '{path}' not found.")
+        else:
+            import_members(path, faction_id)
+    elif choice == 'e':
+        path = input("Path of the file to create (e.g. members.csv): ").strip().strip('"')
+        if not path:
+            print("\n--- Operation cancelled. ---")
+            return
+        include_keys = input("Include API keys in the file? (yes/no): ").strip().lower() == 'yes'
+        try:
+            count = export_members(path, include_keys, faction_id)
+            if count is None:
+                print("\n!!! Nothing exported. Export without API keys, or enter the passphrase.")
+                return
+            print(f"\n--- Exported {count} members to '{path}'. ---")
+            if include_keys:
+                print("!!! This file contains API keys. Keep it private.")
+        except (OSError, ValueError) as e:
+            print(f"\n!!! Export failed: {e}")
+    else:
+        print("\n--- Operation cancelled. ---")
+
+
+# --- Faction Roster Sync ---
+# One request with a leader's key returns the whole in-game roster. It is compared with the
+# faction's members as sets: newcomers are added (new players are flagged until they provide a
+# key), members who left are marked with left_faction_timestamp (and skipped by its updates),
+# returning members are reactivated and renamed players get their new name. Everything is applied
+# in one commit. Joining never takes anyone out of a competition; a player can only be in one Torn
+# faction, though, so one still active in another synced faction is marked as having left it.
+
+RosterSyncResult = namedtuple('RosterSyncResult', 'joined left returned renamed moved')
+
+def fetch_faction_roster(api_key, torn_faction_id=None, metrics=None):
+    """
+    Fetches a faction's roster (the key owner's faction if torn_faction_id is None).
+    Returns (torn_faction_id, faction_name, {user_id: name}, None) or (None, None, None, ApiError).
+    """
+    import requests
+    url = f"{FACTION_API_URL}{torn_faction_id or ''}?selections=basic&key={api_key}"
+    try:
+        response = api_get(url, metrics)
+        response.raise_for_status()
+        data = response.json()
+    except requests.exceptions.RequestException as e:
+        return None, None, None, ApiError(None, _without_key(f"HTTP Request failed: {e}", api_key))
+    except ValueError: # Invalid JSON
+        return None, None, None, ApiError(None, "Failed to parse JSON response from API.")
+    if 'error' in data:
+        error_info = data['error']
+        return None, None, None, ApiError(error_info.get('code'), error_info.get('error', 'Unknown API error'))
+    if not isinstance(data.get('members'), dict) or not data.get('ID'):
+        return None, None, None, ApiError(None, "Response has no faction roster (is the key owner in a faction?).")
+    roster = {int(user_id): (info or {}).get('name') for user_id, info in data['members'].items()}
+    return int(data['ID']), data.get('name'), roster, None
+
+def sync_faction_roster(faction_id, api_key=None, torn_faction_id=None):
+    """
+    Brings a faction's members in line with its in-game roster.
+    api_key / torn_faction_id are remembered on the faction, so later syncs need neither.
+    Returns (RosterSyncResult of user_id lists, None) or (None, error message).
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT torn_faction_id, api_key FROM factions WHERE faction_id = ?", (faction_id,))
+    faction = cursor.fetchone()
+    if faction is None:
+        return None, f"Faction {faction_id} does not exist."
+    torn_faction_id = torn_faction_id or faction['torn_faction_id']
+    if not (api_key or faction['api_key']):
+        return None, "No API key for this faction yet. Provide a faction leader's (or officer's) key."
+    if not unlock_vault():
+        return None, "The API keys are encrypted and could not be unlocked."
+    try:
+        api_key = api_key or reveal_api_key(faction['api_key'])
+        stored_key = seal_api_key(api_key)
+    except ValueError as e:
+        return None, f"Could not read the faction's API key: {e}"
+
+    fetched_id, torn_name, roster, error = fetch_faction_roster(api_key, torn_faction_id)
+    if error:
+        return None, str(error)
+
+    # Everyone already in this faction, plus roster players tracked anywhere
+    cursor.execute("""
+        SELECT m.user_id, m.name, fm.faction_id IS NOT NULL AS in_faction, fm.left_faction_timestamp
+        FROM members m
+        LEFT JOIN faction_members fm ON fm.faction_id = :faction_id AND fm.user_id = m.user_id
+        WHERE fm.faction_id IS NOT NULL OR m.user_id IN (SELECT value FROM json_each(:roster))
+    """, {'faction_id': faction_id, 'roster': json.dumps(list(roster))})
+    known = {row['user_id']: row for row in cursor.fetchall()}
+    in_faction = {user_id for user_id, row in known.items() if row['in_faction']}
+    active = {user_id for user_id in in_faction if known[user_id]['left_faction_timestamp'] is None}
+    roster_ids = set(roster)
+    # Still counted in another faction synced from Torn: they changed factions in game
+    cursor.execute("""
+        SELECT DISTINCT fm.user_id FROM faction_members fm
+        JOIN factions f ON f.faction_id = fm.faction_id
+        WHERE fm.user_id IN (SELECT value FROM json_each(:roster)) AND fm.faction_id != :faction_id
+          AND fm.left_faction_timestamp IS NULL AND f.torn_faction_id IS NOT NULL
+    """, {'faction_id': faction_id, 'roster': json.dumps(list(roster))})
+    moved = {row[0] for row in cursor.fetchall()}
+
+    joined = roster_ids - in_faction # New players, or tracked ones (in other factions or none)
+    left = active - roster_ids
+    returned = (roster_ids & in_faction) - active
+    renamed = {user_id for user_id in roster_ids & set(known) if roster[user_id] and roster[user_id] != known[user_id]['name']}
+    now_timestamp = int(time.time())
+    try:
+        # New players get an empty key: listed as [NO API KEY] and skipped until an officer adds one
+        cursor.executemany("""
+            INSERT INTO members (user_id, api_key, name) VALUES (?, '', ?)
+            ON CONFLICT(user_id) DO UPDATE SET name = COALESCE(excluded.name, members.name)
+        """, ((user_id, roster[user_id]) for user_id in (joined - set(known)) | renamed))
+        cursor.executemany("""
+            INSERT INTO faction_members (faction_id, user_id) VALUES (?, ?)
+            ON CONFLICT (faction_id, user_id) DO UPDATE SET left_faction_timestamp = NULL
+        """, ((faction_id, user_id) for user_id in joined | returned))
+        cursor.executemany("UPDATE faction_members SET left_faction_timestamp = ? WHERE faction_id = ? AND user_id = ?",
+                           ((now_timestamp, faction_id, user_id) for user_id in left))
+        cursor.executemany("""
+            UPDATE faction_members SET left_faction_timestamp = ?
+            WHERE user_id = ? AND faction_id != ? AND left_faction_timestamp IS NULL
+              AND faction_id IN (SELECT faction_id FROM factions WHERE torn_faction_id IS NOT NULL)
+        """, ((now_timestamp, user_id, faction_id) for user_id in moved))
+        cursor.execute("""
+            UPDATE factions SET torn_faction_id = ?, api_key = ?, last_sync_timestamp = ? WHERE faction_id = ?
+        """, (fetched_id, stored_key, now_timestamp, faction_id))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return None, f"Torn faction {fetched_id} ({torn_name}) is already linked to another faction in this tracker."
+    except sqlite3.Error as e:
+        conn.rollback()
+        return None, f"Database error during sync: {e}"
+    return RosterSyncResult(sorted(joined), sorted(left), sorted(returned), sorted(renamed - returned), sorted(moved)), None
+
+def print_sync_result(result):
+    """Summarises a roster sync."""
+    print(f"\n--- Roster synced: {len(result.joined)} joined, {len(result.moved)} moved from another faction, "
+          f"{len(result.left)} left, {len(result.returned)} returned, {len(result.renamed)} renamed. ---")
+    if result.joined:
+        print(f"Joined (players new to the tracker need an API key before they are fetched): "
+              f"{', '.join(map(str, result.joined))}")
+    if result.left:
+        print(f"Left the faction (no longer fetched, stats kept): {', '.join(map(str, result.left))}")
+    if result.returned:
+        print(f"Back in the faction: {', '.join(map(str, result.returned))}")
+    if result.moved:
+        print(f"Moved here from another synced faction (marked as left there): {', '.join(map(str, result.moved))}")
 
 
 # --- Menu System ---
 
-def display_main_menu():
+def factions_interactive(active_faction_id=None):
+    """Lists factions/competitions and lets the officer create, switch, (un)assign or delete them. Returns the active faction_id."""
+    print("\n--- Factions / Competitions ---")
+    try:
+        factions = get_factions()
+    except sqlite3.Error as e:
+        print(f"\n!!! Database error listing factions: {e}")
+        return active_faction_id
+    print(f"{'ID':<6} {'Name':<30} {'Members'}")
+    print("-" * 45)
+    for faction in factions:
+        marker = "  <- active" if faction['faction_id'] == active_faction_id and active_faction_id is not None else ""
+        faction_id_text = faction['faction_id'] if faction['faction_id'] is not None else '-'
+        print(f"{faction_id_text:<6} {faction['name']:<30} {faction['member_count']}{marker}")
+    print("-" * 45)
+    print(f"Currently working with: {faction_name(active_faction_id)}")
+    choice = input("(S)witch faction, show (A)ll, (N)ew faction, assi(G)n members, (U)nassign members, "
+                   "s(Y)nc roster from Torn, (D)elete faction, or (C)ancel? ").strip().lower()
+    if choice == 's':
+        target = input("Faction name or ID: ").strip()
+        faction_id = find_faction(target) if target else None
+        if faction_id is None:
+            print(f"!!! No faction called '{target}'.")
+            return active_faction_id
+        print(f"\n--- Now working with '{faction_name(faction_id)}'. ---")
+        return faction_id
+    if choice == 'a':
+        print("\n--- Now working with all factions. ---")
+        return None
+    if choice == 'n':
+        name = input("Name of the new faction or competition: ").strip()
+        if not name:
+            print("\n--- Operation cancelled. ---")
+            return active_faction_id
+        faction_id = add_faction(name)
+        if faction_id is not None:
+            print(f"\n--- '{faction_name(faction_id)}' is ready and now active. New members will be added to it. ---")
+            return faction_id
+    elif choice in ('g', 'u'):
+        assigning = choice == 'g'
+        prompt = "Add to faction (name or ID): " if assigning else "Take out of faction (name or ID, empty = every faction): "
+        target = input(prompt).strip()
+        faction_id = find_faction(target) if target else None
+        if (target or assigning) and faction_id is None:
+            print(f"!!! No faction called '{target}'.")
+            return active_faction_id
+        ids_text = input("User IDs (separated by commas or spaces): ")
+        try:
+            user_ids = [int(part) for part in re.split(r'[\s,]+', ids_text.strip()) if part]
+        except ValueError:
+            print("!!! User IDs must be numbers.")
+            return active_faction_id
+        if assigning:
+            added = assign_members_to_faction(user_ids, faction_id)
+            print(f"\n--- {added} of {len(user_ids)} members are now in '{faction_name(faction_id)}' "
+                  f"(their other factions are kept). ---")
+        else:
+            removed = unassign_members(user_ids, faction_id)
+            print(f"\n--- Ended {removed} memberships in {f'{faction_name(faction_id)!r}' if faction_id else 'any faction'}. ---")
+    elif choice == 'y':
+        target = input(f"Faction to sync (name or ID) [{faction_name(active_faction_id)}]: ").strip()
+        faction_id = find_faction(target) if target else active_faction_id
+        if faction_id is None:
+            print(f"!!! No faction called '{target}'." if target else "!!! Pick a faction to sync.")
+            return active_faction_id
+        api_key = input("Faction leader's API key (press Enter to use the saved one): ").strip() or None
+        result, error = sync_faction_roster(faction_id, api_key)
+        if error:
+            print(f"\n!!! Sync failed: {error}")
+        else:
+            print_sync_result(result)
+    elif choice == 'd':
+        target = input("Faction to delete (name or ID): ").strip()
+        faction_id = find_faction(target) if target else None
+        if faction_id is None:
+            print(f"!!! No faction called '{target}'.")
+            return active_faction_id
+        confirm = input(f"Delete '{faction_name(faction_id)}'? Its members and their stats are kept. (yes/no): ").strip().lower()
+        if confirm == 'yes' and remove_faction(faction_id):
+            print("\n--- Faction deleted. ---")
+            return None if faction_id == active_faction_id else active_faction_id
+        print("\n--- Deletion cancelled. ---")
+    else:
+        print("\n--- Operation cancelled. ---")
+    return active_faction_id
+
+def display_main_menu(active_faction_id=None):
     """Prints the main menu options."""
-    # Displaying the menu remains the same
     print("\n===== Torn Faction Crime Tracker Menu =====")
+    print(f" Working with: {faction_name(active_faction_id)}")
     print(" 1. Add / Update Member")
     print(" 2. Remove Member")
     print(" 3. List All Members (and Edit/Delete)")
     print(" 4. Update All Member Stats (Fetch from API)")
-    print(" 5. Show Crime Results (Since Last Update)")
+    print(" 5. Show Crime Results (Since Last Update or Custom Period)")
+    print(" 6. Import / Export Members (CSV or JSON)")
+    print(" 7. Factions / Competitions (Switch, Create, Assign)")
+    print(" 8. Activity & Trends (Per Day/Hour, Slowdowns, Streaks)")
+    print(f" 9. API Key Passphrase ({'Change' if vault_enabled() else 'Keys NOT Encrypted, Set One'})")
     print(" 0. Exit")
     print("==========================================")
 
-def main_loop():
-    """Runs the main interactive menu loop."""
+def main_loop(active_faction_id=None):
+    """Runs the main interactive menu loop. Every action is scoped to the active faction (None = all)."""
     while True:
         clear_screen() # <--- ADD THIS LINE to clear before showing menu
-        display_main_menu()
-        choice = input("Enter your choice (0-5): ").strip()
+        display_main_menu(active_faction_id)
+        choice = input("Enter your choice (0-9): ").strip()
 
         # --- Execute chosen action ---
         if choice == '1':
-            add_member_interactive()
+            add_member_interactive(active_faction_id)
         elif choice == '2':
             remove_member_interactive()
         elif choice == '3':
-            list_members()
+            list_members(active_faction_id)
         elif choice == '4':
-            update_all_stats()
+            lock = LockFile(LOCK_FILE) # Don't write alongside a running daemon
+            if lock.acquire():
+                try:
+                    update_stats_interactive(active_faction_id)
+                finally:
+                    lock.release()
+            else:
+                print("\n!!! A scheduled collector (daemon mode) is running right now. It will keep stats up to date.")
         elif choice == '5':
-            show_results()
+            show_results_interactive(active_faction_id)
+        elif choice == '6':
+            import_export_interactive(active_faction_id)
+        elif choice == '7':
+            active_faction_id = factions_interactive(active_faction_id)
+        elif choice == '8':
+            analytics_interactive(active_faction_id)
+        elif choice == '9':
+            vault_interactive()
         elif choice == '0':
             print("\nExiting program. Goodbye!")
             break
         else:
             # No action taken, just show error message
-            print("\n!!! Invalid choice. Please enter a number between 0 and 5. !!!")
+            print("\n!!! Invalid choice. Please enter a number between 0 and 9. !!!")
             # Optional short pause after invalid choice before clearing again
             # time.sleep(1.5)
             # Continue directly to clear screen and show menu again
@@ -559,9 +3096,654 @@ def main_loop():
              # The loop will then restart, clear the screen, and show the menu
 
 
+# --- Daemon (Scheduled Collection) Mode ---
+
+def parse_duration(text):
+    """Parses durations like '90', '45s', '15m', '2h' or '1d' into seconds."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    text = str(text).strip().lower()
+    try:
+        if text and text[-1] in units:
+            seconds = float(text[:-1]) * units[text[-1]]
+        else:
+            seconds = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration '{text}' (use e.g. 30s, 15m, 2h)")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"duration must be positive, got '{text}'")
+    return seconds
+
+def format_duration(seconds):
+    """Formats seconds the same way parse_duration() reads them."""
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size and seconds % size == 0:
+            return f"{int(seconds // size)}{unit}"
+    return f"{seconds:g}s"
+
+
+class LockFile:
+    """
+    Exclusive, non-blocking lock on a file next to the database.
+    The OS drops the lock if the process dies, so a crash never leaves a stale lock behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    def acquire(self):
+        """Takes the lock. Returns False if another process already holds it."""
+        handle = open(self.path, 'a+')
+        try:
+            if platform.system() == "Windows":
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(f"{os.getpid()}\n")
+        handle.flush()
+        self._handle = handle
+        return True
+
+    def release(self):
+        """Releases the lock (closing the file is enough on every platform)."""
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+
+
+def run_daemon(interval_seconds, skip_fresh_seconds=None, metrics_file=None, faction_id=None):
+    """
+    Runs update_all_stats() every interval (+/- jitter) until SIGTERM/SIGINT.
+    Without faction_id, all factions are fetched together in each cycle.
+    A stop request lets the current cycle finish and commit before exiting.
+    """
+    lock = LockFile(LOCK_FILE)
+    if not lock.acquire():
+        print(f"!!! Another tracker instance holds '{LOCK_FILE}'. Is a daemon already running? Exiting.")
+        return 1
+    if not unlock_vault(): # Once, up front: every cycle then reuses the decrypted keys
+        lock.release()
+        return 1
+
+    stop_event = threading.Event()
+    def _request_stop(signum, frame):
+        print(f"\nReceived signal {signum}, stopping after the current cycle...")
+        stop_event.set()
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    if skip_fresh_seconds is None:
+        skip_fresh_seconds = interval_seconds / 2
+    jitter = interval_seconds * DAEMON_JITTER_FRACTION
+    print(f"Daemon started for {faction_name(faction_id)}: fetching every {format_duration(interval_seconds)} "
+          f"(+/- {format_duration(round(jitter))}), skipping members fetched within {format_duration(skip_fresh_seconds)}.")
+    try:
+        while not stop_event.is_set():
+            print(f"\n=== Scheduled update at {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')} UTC ===")
+            update_all_stats(skip_fresh_seconds=skip_fresh_seconds, metrics_file=metrics_file, faction_id=faction_id)
+            delay = max(1.0, interval_seconds + random.uniform(-jitter, jitter))
+            print(f"Next update in {format_duration(round(delay))}.")
+            stop_event.wait(delay)
+    finally:
+        lock.release()
+    print("Daemon stopped.")
+    return 0
+
+
+# --- Read-only JSON Endpoint ---
+# `serve` answers GET /leaderboard, /members and /member/<id> from bodies built in memory. They are
+# rebuilt only when PRAGMA data_version says another connection (an update run, the daemon, the
+# menu) has committed since, which SQLite answers without reading the file, so clients polling
+# every few seconds cost no queries. Each body carries an ETag, and a matching If-None-Match
+# gets an empty 304. Times are Unix timestamps, as in the CLI's json output; keys are never sent.
+
+def _serve_member_columns(faction_id):
+    return f"""m.user_id, m.name,
+                   (SELECT json_group_array(fm.faction_id) FROM faction_members fm WHERE fm.user_id = m.user_id) AS faction_ids,
+                   m.last_crime_count, m.last_update_timestamp,
+                   CASE WHEN m.key_error_code IS NOT NULL THEN 'key_quarantined'
+                        WHEN {_left_faction_sql(faction_id)} IS NOT NULL THEN 'left_faction'
+                        WHEN m.api_key = '' THEN 'no_key'
+                        ELSE 'active' END AS status"""
+
+def _serve_member(row):
+    return dict(row, faction_ids=json.loads(row['faction_ids']))
+
+def _query_time(text):
+    """A since/until query value: a Unix time or a UTC date as accepted by --since."""
+    return int(text) if text.isdigit() else _parse_time_input(text)
+
+def _serve_payload(path, query):
+    """Answers one GET of `path` with its decoded query parameters. Returns (status, JSON-ready payload)."""
+    faction_id = None
+    if query.get('faction'):
+        faction_id = find_faction(query['faction'])
+        if faction_id is None:
+            return 404, {'error': f"No faction called '{query['faction']}'."}
+    cursor = get_db().cursor()
+    if path == '/leaderboard':
+        try:
+            since = _query_time(query['since']) if query.get('since') else None
+            until = _query_time(query['until']) if query.get('until') else None
+        except ValueError:
+            return 400, {'error': "since/until must be Unix times or dates like 2024-05-01 (UTC)."}
+        top = query.get('top')
+        if top is not None and (not top.isdigit() or int(top) <= 0):
+            return 400, {'error': "top must be a positive number."}
+        top = int(top) if top else None
+        rows = get_leaderboard(since, until, top, faction_id)
+        return 200, {'since': since, 'until': until, 'top': top, 'faction_id': faction_id,
+                     'rows': [row._asdict() for row in rows]}
+    if path == '/members':
+        member_scope = "" if faction_id is None else f"WHERE {_IN_FACTION_SQL}"
+        cursor.execute(f"SELECT {_serve_member_columns(faction_id)} FROM members m {member_scope} ORDER BY m.user_id",
+                       {'faction_id': faction_id})
+        return 200, {'faction_id': faction_id, 'members': [_serve_member(row) for row in cursor.fetchall()]}
+    member_match = re.fullmatch(r'/member/(\d+)', path)
+    if not member_match:
+        return 404, {'error': "Unknown path. Try /leaderboard, /members or /member/<user_id>."}
+    user_id = int(member_match.group(1))
+    cursor.execute(f"SELECT {_serve_member_columns(None)} FROM members m WHERE m.user_id = ?", (user_id,))
+    member = cursor.fetchone()
+    if member is None:
+        return 404, {'error': f"No member with ID {user_id}."}
+    payload = _serve_member(member)
+    # MAX() makes SQLite take `value` from the newest snapshot of each stat
+    cursor.execute("SELECT stat, value, MAX(ts) FROM stat_snapshots WHERE user_id = ? GROUP BY stat", (user_id,))
+    payload['stats'] = {row['stat']: row['value'] for row in cursor.fetchall()}
+    cursor.execute(f"""
+        SELECT bucket_start AS day, crimes FROM {ROLLUP_TABLES['day']}
+        WHERE user_id = ? ORDER BY bucket_start DESC LIMIT 30
+    """, (user_id,))
+    payload['daily_crimes'] = [dict(row) for row in reversed(cursor.fetchall())]
+    return 200, payload
+
+def _json_response(status, payload):
+    """(status, etag, body) for a payload. The ETag is a hash of the body, so it only changes with the data."""
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return status, f'"{hashlib.sha1(body).hexdigest()[:20]}"', body
+
+class ServeCache:
+    """
+    The JSON endpoint's precomputed responses, keyed on (path, query). The default leaderboard and
+    member list are always kept; other requests join them on first use (the oldest are dropped past
+    max_entries). refresh() rebuilds all of them at once when the database has changed.
+    """
+    ALWAYS_BUILT = (('/leaderboard', ()), ('/members', ()))
+
+    def __init__(self, max_entries=SERVE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.rebuilds = 0
+        self._entries = {} # (path, query) -> (status, etag, body); replaced whole, never changed in place
+        self._data_version = None
+        self._db_lock = threading.Lock() # Only one request thread at a time queries the shared connection
+
+    def refresh(self):
+        """Rebuilds every response if anything was committed since the last build. Returns True if it did."""
+        with self._db_lock:
+            data_version = get_db().execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return False
+            keys = list(dict.fromkeys((*self.ALWAYS_BUILT, *self._entries)))
+            self._entries = {key: _json_response(*_serve_payload(key[0], dict(key[1]))) for key in keys}
+            self._data_version = data_version
+            self.rebuilds += 1
+            return True
+
+    def get(self, path, query):
+        """Returns (status, etag, body) for a GET of `path` with its decoded query parameters."""
+        key = (path, tuple(sorted(query.items())))
+        response = self._entries.get(key)
+        if response is not None: # The common case: no lock, no query
+            return response
+        with self._db_lock:
+            response = self._entries.get(key)
+            if response is None:
+                response = _json_response(*_serve_payload(path, query))
+                entries = dict(self._entries)
+                entries[key] = response
+                while len(entries) > max(self.max_entries, len(self.ALWAYS_BUILT)):
+                    del entries[next(old_key for old_key in entries if old_key not in self.ALWAYS_BUILT)]
+                self._entries = entries
+            return response
+
+def serve_leaderboards(host=SERVE_DEFAULT_HOST, port=SERVE_DEFAULT_PORT):
+    """Runs the read-only JSON endpoint until SIGTERM/SIGINT. Returns an exit code."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qsl
+
+    cache = ServeCache()
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive for clients that poll
+
+        def log_message(self, format, *args):
+            pass # One line per poll would bury everything else
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                status, etag, body = cache.get(url.path.rstrip('/') or '/', dict(parse_qsl(url.query)))
+            except sqlite3.Error as e:
+                status, etag, body = _json_response(503, {'error': f"Database error: {e}"})
+            wanted = {tag.strip().removeprefix('W/') for tag in self.headers.get('If-None-Match', '').split(',')}
+            if status == 200 and (etag in wanted or '*' in wanted):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache") # Clients may keep it, but must revalidate
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        cache.refresh()
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except (OSError, sqlite3.Error) as e:
+        print(f"!!! Could not start the JSON endpoint on {host}:{port}: {e}")
+        return 1
+    server.daemon_threads = True
+    stop_event = threading.Event()
+    def _request_stop(signum, frame):
+        stop_event.set()
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving /leaderboard, /members and /member/<id> on http://{host}:{server.server_port}/ "
+          f"(read-only, Ctrl+C to stop).")
+    try:
+        while not stop_event.wait(SERVE_REFRESH_SECONDS):
+            try:
+                if cache.refresh():
+                    print(f"{datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')} UTC: new data, "
+                          "responses rebuilt.")
+            except sqlite3.Error as e:
+                print(f"!!! Could not rebuild the responses, still serving the previous ones: {e}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("JSON endpoint stopped.")
+    return 0
+
+
+# --- Command Line Interface ---
+
+def _time_argument(text):
+    """argparse type for --since/--until."""
+    try:
+        return _parse_time_input(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time '{text}' (use YYYY-MM-DD or 'YYYY-MM-DD HH:MM', UTC)")
+
+def _positive_int(text):
+    """argparse type for counts like --top."""
+    if not text.isdigit() or int(text) <= 0:
+        raise argparse.ArgumentTypeError(f"expected a positive number, got '{text}'")
+    return int(text)
+
+def write_rows(rows, fields, output_format, out=None):
+    """Streams rows (tuples matching `fields`) as 'csv' or 'json' (an array, written one element at a time)."""
+    out = out or sys.stdout
+    if output_format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow(row)
+        return
+    out.write('[')
+    for index, row in enumerate(rows):
+        out.write(',\n' if index else '\n')
+        out.write(json.dumps(dict(zip(fields, row))))
+    out.write('\n]\n')
+
+def command_add(args):
+    """`add`: adds or updates one member without prompts."""
+    if not API_KEY_PATTERN.fullmatch(args.api_key):
+        print("!!! API key must be 16 letters/digits.", file=sys.stderr)
+        return 1
+    return 0 if _add_or_update_member_db(args.user_id, args.api_key, args.name, args.faction_id) else 1
+
+def command_remove(args):
+    """`remove`: removes a member and their stats without asking for confirmation."""
+    if _remove_member_db(args.user_id):
+        print(f"Member {args.user_id} removed.")
+        return 0
+    print(f"!!! Member with User ID {args.user_id} not found.", file=sys.stderr)
+    return 1
+
+def command_list(args):
+    """`list`: prints the members."""
+    fields = ('user_id', 'name', 'last_crime_count', 'last_update_timestamp', 'key_error_code', 'left_faction_timestamp')
+    columns = ', '.join(f"m.{field}" for field in fields[:-1]) + f", {_left_faction_sql(args.faction_id)}"
+    member_scope = "" if args.faction_id is None else f"WHERE {_IN_FACTION_SQL}"
+    cursor = get_db().cursor()
+    cursor.row_factory = None # Plain tuples
+    cursor.execute(f"SELECT {columns} FROM members m {member_scope} ORDER BY m.name COLLATE NOCASE, m.user_id",
+                   {'faction_id': args.faction_id})
+    if args.format == 'table':
+        print(f"{'User ID':<10} {'Name':<25} {'Crimes':<10} {'Last Stat Update (UTC)'}")
+        for user_id, name, crimes, last_update, key_error_code, left_faction_timestamp in cursor:
+            status = f"  [KEY QUARANTINED: code {key_error_code}]" if key_error_code is not None else ""
+            if left_faction_timestamp:
+                status += f"  [LEFT FACTION {_short_time(left_faction_timestamp, '%Y-%m-%d')}]"
+            crimes_text = crimes if crimes is not None else '-'
+            last_update_text = _short_time(last_update, '%Y-%m-%d %H:%M:%S') if last_update else 'Never'
+            print(f"{user_id:<10} {name or '(No Name Set)':<25} {crimes_text:<10} {last_update_text}{status}")
+    else:
+        write_rows(cursor, fields, args.format)
+    return 0
+
+def command_update(args):
+    """`update`: one fetch run, for cron/scripts. Refuses to run next to a daemon."""
+    lock = LockFile(LOCK_FILE)
+    if not lock.acquire():
+        print(f"!!! Another tracker instance holds '{LOCK_FILE}' (daemon running?).", file=sys.stderr)
+        return 1
+    try:
+        success_count, fail_count = update_all_stats(args.older_than, args.only_failed, args.metrics_file, args.force,
+                                                     args.faction_id)
+    finally:
+        lock.release()
+    return 1 if fail_count and not success_count else 0
+
+def command_results(args):
+    """`results`: the leaderboard for a period."""
+    if args.format == 'table':
+        show_results(args.since, args.until, args.top, args.faction_id)
+        return 0
+    fields = LeaderboardRow._fields
+    write_rows(get_leaderboard(args.since, args.until, args.top, args.faction_id), fields, args.format)
+    return 0
+
+def command_analytics(args):
+    """`analytics`: crimes per day/hour, trends and streaks from the rollups."""
+    if args.analytics_action == 'rebuild':
+        print(f"Rebuilt the activity rollups from {rebuild_rollups()} snapshots.")
+        return 0
+    update_rollups()
+    if args.analytics_action == 'activity':
+        since = args.since if args.since is not None else _bucket_floor('day', time.time() - 7 * 86400)
+        if args.format == 'table':
+            show_activity(args.by, since, args.until, args.faction_id, args.per_member)
+        else:
+            write_rows(get_activity(args.by, since, args.until, args.faction_id, args.per_member),
+                       ActivityRow._fields, args.format)
+    elif args.analytics_action == 'trends':
+        if args.format == 'table':
+            show_trends(args.period, args.faction_id)
+        else:
+            write_rows(get_trends(args.period, faction_id=args.faction_id), TrendRow._fields, args.format)
+    elif args.format == 'table':
+        show_streaks(args.faction_id)
+    else:
+        write_rows(get_streaks(args.faction_id), StreakRow._fields, args.format)
+    return 0
+
+def command_vault(args):
+    """`vault`: shows whether API keys are encrypted, or sets/changes the passphrase."""
+    if args.vault_action == 'status':
+        print("API keys are encrypted." if vault_enabled() else "API keys are stored unencrypted.")
+        return 0
+    if not sys.stdin.isatty():
+        print("!!! Setting a passphrase needs a terminal to type it in.", file=sys.stderr)
+        return 1
+    passphrase = _ask_new_passphrase()
+    return 0 if passphrase and set_vault_passphrase(passphrase) else 1
+
+def command_compact(args):
+    """`compact`: thins the old snapshot history now and reports the space freed."""
+    return 0 if compact_snapshots(args.keep_raw, args.keep_hourly, args.full, args.vacuum) else 1
+
+def command_replay(args):
+    """`replay`: stores the responses in a journal again, without any API request."""
+    return 0 if replay_journal(args.path, args.since, args.until) else 1
+
+def command_serve(args):
+    """`serve`: the read-only JSON endpoint for bots and dashboards."""
+    return serve_leaderboards(args.host, args.port)
+
+def command_import(args):
+    """`import`: bulk-loads a roster file."""
+    return 0 if import_members(args.path, args.faction_id) else 1
+
+def command_export(args):
+    """`export`: writes the members to a roster file."""
+    try:
+        count = export_members(args.path, include_keys=not args.no_keys, faction_id=args.faction_id)
+    except (OSError, ValueError) as e:
+        print(f"!!! Export failed: {e}", file=sys.stderr)
+        return 1
+    if count is None:
+        print("!!! Nothing exported: the API keys are encrypted. Set the passphrase, or use --no-keys.", file=sys.stderr)
+        return 1
+    print(f"Exported {count} members to '{args.path}'.")
+    return 0
+
+def command_faction(args):
+    """`faction`: list, create, delete factions/competitions and add members to them or take them out."""
+    if args.faction_action == 'list':
+        fields = ('faction_id', 'name', 'member_count')
+        if args.format == 'table':
+            print(f"{'ID':<6} {'Name':<30} {'Members'}")
+            for faction in get_factions():
+                print(f"{faction['faction_id'] if faction['faction_id'] is not None else '-':<6} {faction['name']:<30} {faction['member_count']}")
+        else:
+            write_rows((tuple(faction[f] for f in fields) for faction in get_factions()), fields, args.format)
+        return 0
+    if args.faction_action == 'add':
+        faction_id = add_faction(args.name)
+        if faction_id is None:
+            return 1
+        print(f"Faction '{faction_name(faction_id)}' has ID {faction_id}.")
+        return 0
+    faction_id = find_faction(args.name) if args.name else None
+    if args.name and faction_id is None and args.faction_action != 'sync':
+        print(f"!!! No faction called '{args.name}'.", file=sys.stderr)
+        return 1
+    if args.faction_action == 'sync':
+        if faction_id is None:
+            if not args.key:
+                print(f"!!! No faction called '{args.name}' yet. Pass --key to create and sync it.", file=sys.stderr)
+                return 1
+            faction_id = add_faction(args.name)
+        result, error = sync_faction_roster(faction_id, args.key, args.torn_id)
+        if error:
+            print(f"!!! Sync failed: {error}", file=sys.stderr)
+            return 1
+        print_sync_result(result)
+        return 0
+    if args.faction_action == 'remove':
+        remove_faction(faction_id)
+        print(f"Faction '{args.name}' removed, its members are kept.")
+        return 0
+    if args.faction_action == 'unassign':
+        ended = unassign_members(args.user_ids, faction_id)
+        print(f"Ended {ended} memberships in {f'{faction_name(faction_id)!r}' if faction_id else 'any faction'}.")
+        return 0
+    if faction_id is None:
+        print("!!! Name the faction to add the members to (use 'faction unassign' to take them out).", file=sys.stderr)
+        return 1
+    added = assign_members_to_faction(args.user_ids, faction_id)
+    print(f"{added} of {len(args.user_ids)} members are now in '{faction_name(faction_id)}'.")
+    return 0 if added == len(args.user_ids) else 1
+
+def build_parser():
+    """Builds the command line parser. No command (and no --daemon) starts the interactive menu."""
+    parser = argparse.ArgumentParser(description="Torn Faction Crime Tracker. Run without a command for the interactive menu.")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Run unattended, fetching stats on a schedule instead of showing the menu")
+    parser.add_argument('--interval', type=parse_duration, default=parse_duration(DAEMON_DEFAULT_INTERVAL),
+                        help=f"Time between scheduled fetches, e.g. 30m or 2h (default: {DAEMON_DEFAULT_INTERVAL})")
+    parser.add_argument('--skip-fresh', type=parse_duration, default=None,
+                        help="Skip members fetched more recently than this (default: half the interval)")
+    parser.add_argument('--metrics-file', default=METRICS_TEXTFILE,
+                        help="Write Prometheus-style metrics of each update run to this file")
+    parser.add_argument('--journal', default=RESPONSE_JOURNAL,
+                        help="Append every raw API response to this file (.gz, or .zst with the zstandard package)")
+    parser.add_argument('--db', default=None,
+                        help=f"Database file to use (default: {DATABASE_FILE}, or the TORN_TRACKER_DB environment variable)")
+    parser.add_argument('--faction', dest='daemon_faction', default=None,
+                        help="With --daemon or the menu: only work with this faction/competition (name or ID)")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    # Commands that work on members accept --faction to scope them to one faction/competition
+    scoped = argparse.ArgumentParser(add_help=False)
+    scoped.add_argument('--faction', default=None, help="Faction/competition name or ID (default: all)")
+
+    add_parser = commands.add_parser('add', parents=[scoped], help="Add or update a member")
+    add_parser.add_argument('user_id', type=_positive_int)
+    add_parser.add_argument('api_key')
+    add_parser.add_argument('--name', default=None)
+    add_parser.set_defaults(handler=command_add)
+
+    remove_parser = commands.add_parser('remove', help="Remove a member and their stats (no confirmation)")
+    remove_parser.add_argument('user_id', type=_positive_int)
+    remove_parser.set_defaults(handler=command_remove)
+
+    list_parser = commands.add_parser('list', parents=[scoped], help="List members")
+    list_parser.add_argument('--format', choices=('table', 'json', 'csv'), default='table')
+    list_parser.set_defaults(handler=command_list)
+
+    update_parser = commands.add_parser('update', parents=[scoped], help="Fetch stats once (all factions in one pass by default)")
+    update_parser.add_argument('--older-than', type=parse_duration, default=None,
+                               help="Only members whose last update is older than this, e.g. 1h")
+    update_parser.add_argument('--only-failed', action='store_true', help="Only members whose last fetch failed")
+    update_parser.add_argument('--force', action='store_true',
+                               help=f"Ignore cached API responses (normally reused for {format_duration(API_CACHE_TTL)})")
+    update_parser.set_defaults(handler=command_update)
+
+    results_parser = commands.add_parser('results', parents=[scoped], help="Show the crime leaderboard")
+    results_parser.add_argument('--since', type=_time_argument, default=None,
+                                help="Period start, UTC (default: each member's previous update)")
+    results_parser.add_argument('--until', type=_time_argument, default=None, help="Period end, UTC (default: now)")
+    results_parser.add_argument('--top', type=_positive_int, default=None, help="Only the top N members")
+    results_parser.add_argument('--format', choices=('table', 'json', 'csv'), default='table')
+    results_parser.set_defaults(handler=command_results)
+
+    analytics_parser = commands.add_parser('analytics', help="Crimes per day/hour, trends and activity streaks")
+    analytics_actions = analytics_parser.add_subparsers(dest='analytics_action', metavar='action', required=True)
+    activity_parser = analytics_actions.add_parser('activity', parents=[scoped], help="Crimes per day or hour")
+    activity_parser.add_argument('--by', choices=('day', 'hour'), default='day')
+    activity_parser.add_argument('--since', type=_time_argument, default=None, help="Period start, UTC (default: 7 days ago)")
+    activity_parser.add_argument('--until', type=_time_argument, default=None, help="Period end, UTC (default: now)")
+    activity_parser.add_argument('--per-member', action='store_true', help="One row per member instead of totals")
+    activity_parser.add_argument('--format', choices=('table', 'json', 'csv'), default='table')
+    trends_parser = analytics_actions.add_parser('trends', parents=[scoped],
+                                                 help="Crimes in the last period compared with the one before")
+    trends_parser.add_argument('--period', type=parse_duration, default=parse_duration('7d'),
+                               help="Length of each period, e.g. 1d or 7d (default: 7d)")
+    trends_parser.add_argument('--format', choices=('table', 'json', 'csv'), default='table')
+    streaks_parser = analytics_actions.add_parser('streaks', parents=[scoped], help="Days in a row with crimes")
+    streaks_parser.add_argument('--format', choices=('table', 'json', 'csv'), default='table')
+    analytics_actions.add_parser('rebuild', help="Recompute the rollups from the full snapshot history")
+    analytics_parser.set_defaults(handler=command_analytics)
+
+    vault_parser = commands.add_parser('vault', help="Encrypt the stored API keys with a passphrase")
+    vault_actions = vault_parser.add_subparsers(dest='vault_action', metavar='action', required=True)
+    vault_actions.add_parser('status', help="Show whether the API keys are encrypted")
+    vault_actions.add_parser('passphrase', help="Set the passphrase (encrypting every key) or change it")
+    vault_parser.set_defaults(handler=command_vault)
+
+    compact_parser = commands.add_parser('compact', help="Thin out old snapshots and shrink the database file")
+    compact_parser.add_argument('--keep-raw', type=parse_duration, default=None,
+                                help=f"Keep every snapshot this long (default: {format_duration(SNAPSHOT_RAW_RETENTION)})")
+    compact_parser.add_argument('--keep-hourly', type=parse_duration, default=None,
+                                help=f"Then keep hourly points this long (default: {format_duration(SNAPSHOT_HOURLY_RETENTION)})")
+    compact_parser.add_argument('--full', action='store_true',
+                                help="Rescan the whole history, not just what aged since the last compaction")
+    compact_parser.add_argument('--vacuum', action='store_true',
+                                help="One-off: let a database file from an older version shrink (locks it while running)")
+    compact_parser.set_defaults(handler=command_compact)
+
+    replay_parser = commands.add_parser('replay', help="Store the responses in a --journal file again, without the API")
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--since', type=_time_argument, default=None, help="Only responses fetched from then, UTC")
+    replay_parser.add_argument('--until', type=_time_argument, default=None, help="Only responses fetched until then, UTC")
+    replay_parser.set_defaults(handler=command_replay)
+
+    serve_parser = commands.add_parser('serve', help="Serve the leaderboard and members as read-only JSON over HTTP")
+    serve_parser.add_argument('--host', default=SERVE_DEFAULT_HOST,
+                              help=f"Address to listen on (default: {SERVE_DEFAULT_HOST}, this computer only)")
+    serve_parser.add_argument('--port', type=int, default=SERVE_DEFAULT_PORT, help=f"Port (default: {SERVE_DEFAULT_PORT})")
+    serve_parser.set_defaults(handler=command_serve)
+
+    import_parser = commands.add_parser('import', parents=[scoped], help="Import members from a .csv/.json/.jsonl roster")
+    import_parser.add_argument('path')
+    import_parser.set_defaults(handler=command_import)
+
+    export_parser = commands.add_parser('export', parents=[scoped], help="Export members to a .csv/.json/.jsonl file")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--no-keys', action='store_true', help="Leave API keys out of the file")
+    export_parser.set_defaults(handler=command_export)
+
+    faction_parser = commands.add_parser('faction', help="Manage factions/competitions")
+    faction_actions = faction_parser.add_subparsers(dest='faction_action', metavar='action', required=True)
+    faction_list_parser = faction_actions.add_parser('list', help="List factions and their member counts")
+    faction_list_parser.add_argument('--format', choices=('table', 'json', 'csv'), default='table')
+    faction_add_parser = faction_actions.add_parser('add', help="Create a faction/competition")
+    faction_add_parser.add_argument('name')
+    faction_remove_parser = faction_actions.add_parser('remove', help="Delete a faction (its members are kept)")
+    faction_remove_parser.add_argument('name')
+    faction_assign_parser = faction_actions.add_parser('assign', help="Add members to a faction (their other factions are kept)")
+    faction_assign_parser.add_argument('name')
+    faction_assign_parser.add_argument('user_ids', type=_positive_int, nargs='+')
+    faction_unassign_parser = faction_actions.add_parser('unassign', help="Take members out of a faction ('' = every faction)")
+    faction_unassign_parser.add_argument('name')
+    faction_unassign_parser.add_argument('user_ids', type=_positive_int, nargs='+')
+    faction_sync_parser = faction_actions.add_parser('sync', help="Update a faction's members from its in-game roster")
+    faction_sync_parser.add_argument('name', help="Faction in the tracker (created if it doesn't exist)")
+    faction_sync_parser.add_argument('--key', default=None, help="A faction leader's API key (saved for later syncs)")
+    faction_sync_parser.add_argument('--torn-id', type=_positive_int, default=None,
+                                     help="Torn faction ID (default: the key owner's faction)")
+    faction_parser.set_defaults(handler=command_faction)
+    return parser
+
+def parse_args(argv=None):
+    """Parses command line options."""
+    return build_parser().parse_args(argv)
+
+
 # --- Main Execution ---
 
 if __name__ == "__main__":
-    print("Starting Faction Crime Tracker...")
-    setup_database()
-    main_loop()
\ No newline at end of file
+    args = parse_args()
+    if args.db:
+        set_database_file(args.db)
+    RESPONSE_JOURNAL = args.journal
+    try:
+        if args.command:
+            if not setup_database(verbose=False):
+                exit(1) # Never run on a half-upgraded schema
+            faction_text = getattr(args, 'faction', None)
+            args.faction_id = find_faction(faction_text) if faction_text else None
+            if faction_text and args.faction_id is None:
+                print(f"!!! No faction called '{faction_text}'. Create it with: faction add \"{faction_text}\"", file=sys.stderr)
+                exit(1)
+            exit(args.handler(args))
+        print("Starting Faction Crime Tracker...")
+        if not setup_database():
+            print("!!! The database could not be set up or upgraded, so the tracker can't start. "
+                  "It was left as it was.")
+            exit(1)
+        active_faction_id = find_faction(args.daemon_faction) if args.daemon_faction else None
+        if args.daemon_faction and active_faction_id is None:
+            print(f"!!! No faction called '{args.daemon_faction}'.")
+            exit(1)
+        if args.daemon:
+            exit(run_daemon(args.interval, args.skip_fresh, args.metrics_file, active_faction_id))
+        main_loop(active_faction_id)
+    finally:
+        close_http_session()
+        close_db()
@@ -0,0 +1,246 @@
+"""
+Benchmarks for the tracker, run against a local mock Torn API.
+
+Three suites:
+  update       drives update_all_stats() and show_results() end to end for synthetic rosters
+               (10 / 100 / 1,000 / 10,000 members by default), each in a throwaway database,
+               and reports wall time, requests per second, DB write time and peak memory.
+  connections  compares a fresh connection per request against the pooled keep-alive session.
+  replay       writes a response journal of --runs update cycles for each roster size and times
+               replay_journal() into an empty database: the parse and DB write path alone.
+               The first cycle is cut off as if its run had crashed; the suite exits with 1 if
+               that costs the later cycles any records.
+
+Usage: python benchmark_tracker.py [--suite update|connections|replay|all] [--sizes 10,100,1000]
+                                   [--latency SECONDS] [--runs N] [--save FILE] [--compare FILE]
+
+--save writes the update results as JSON; --compare reads such a file and exits with 1 if
+any size got slower than --threshold times the baseline, so it can guard against regressions.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+import Tornstattracker as tracker
+from mock_torn_api import start_mock_server
+
+
+def bench_connection_reuse(num_requests, latency):
+    """Compares a fresh connection per request against the pooled keep-alive session."""
+    server = start_mock_server(latency=latency)
+    tracker.API_BASE_URL = server.base_url
+    print(f"\n--- Connection reuse: {num_requests} sequential requests (mock latency {latency * 1000:.0f}ms) ---")
+
+    results = {}
+    for label in ("requests.get per call", "pooled session"):
+        connections_before = server.connections_accepted
+        start = time.perf_counter()
+        for user_id in range(1, num_requests + 1):
+            url = f"{tracker.API_BASE_URL}{user_id}?selections=crimes&key=bench"
+            if label == "pooled session":
+                response = tracker.api_get(url)
+            else:
+                response = requests.get(url, headers={'User-Agent': tracker.USER_AGENT}, timeout=tracker.HTTP_TIMEOUT)
+            response.json()
+        elapsed = time.perf_counter() - start
+        results[label] = elapsed
+        connections = server.connections_accepted - connections_before
+        print(f"{label:<24} {elapsed:8.3f}s  {elapsed / num_requests * 1000:7.2f} ms/req  {connections:>5} TCP connections")
+
+    tracker.close_http_session()
+    server.shutdown()
+    saving = results["requests.get per call"] - results["pooled session"]
+    print(f"Saved {saving:.3f}s ({saving / results['requests.get per call'] * 100:.0f}%). "
+          "Against api.torn.com each avoided connection also skips a TLS handshake.")
+
+
+def _add_synthetic_members(count, key_count=None):
+    """Inserts `count` members with valid-looking keys (shared round-robin if key_count is given)."""
+    key_count = key_count or count
+    conn = tracker.get_db()
+    conn.executemany("INSERT INTO members (user_id, api_key, name) VALUES (?, ?, ?)",
+                     ((user_id, f"bench{user_id % key_count:011d}", f"Bench{user_id}")
+                      for user_id in range(1, count + 1)))
+    conn.commit()
+
+
+def _timed(action):
+    """Runs action() with its output discarded. Returns (seconds, result)."""
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = action()
+    return time.perf_counter() - start, result
+
+def _peak_memory(action):
+    """Runs action() under tracemalloc with its output discarded. Returns the peak traced MiB."""
+    tracemalloc.start()
+    try:
+        _timed(action)
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_update_runs(sizes, latency, key_count=None, mock_rate_limit=None):
+    """
+    For each roster size: a warm-up update (fills the first snapshot), a timed forced update
+    and a timed show_results(). Returns one dict of measurements per size.
+    Peak memory comes from tracemalloc (Python allocations only). Tracing slows Python down
+    several times, so it is measured on the warm-up update and on a separate show_results()
+    call, never on the timed runs.
+    """
+    server = start_mock_server(latency=latency, rate_limit=mock_rate_limit)
+    tracker.API_BASE_URL = server.base_url
+    tracker.FACTION_API_URL = server.faction_url
+    print(f"\n--- End-to-end update + results (mock latency {latency * 1000:.0f}ms, "
+          f"{tracker.MAX_WORKERS} workers, {'one key per member' if not key_count else f'{key_count} shared keys'}) ---")
+    print(f"{'Members':>8} {'Update':>9} {'Req/s':>9} {'DB write':>9} {'Peak MiB':>9} {'Results':>9} {'Peak MiB':>9}")
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            tracker.set_database_file(os.path.join(temp_dir, f"bench_{size}.db"))
+            tracker.setup_database(verbose=False)
+            _add_synthetic_members(size, key_count)
+            update_peak = _peak_memory(tracker.update_all_stats) # Warm-up: every member gets a first snapshot
+            requests_before = server.requests_served
+            update_seconds, (success_count, fail_count) = _timed(lambda: tracker.update_all_stats(force=True))
+            request_count = server.requests_served - requests_before
+            cursor = tracker.get_db().cursor()
+            cursor.execute("SELECT db_commit_seconds FROM fetch_runs ORDER BY run_id DESC LIMIT 1")
+            db_write_seconds = cursor.fetchone()[0]
+            results_peak = _peak_memory(tracker.show_results)
+            results_seconds, _ = _timed(tracker.show_results)
+            row = {
+                'members': size,
+                'update_seconds': round(update_seconds, 4),
+                'requests_per_second': round(request_count / update_seconds, 1) if update_seconds else None,
+                'db_write_seconds': round(db_write_seconds, 4),
+                'update_peak_mib': round(update_peak, 2),
+                'results_seconds': round(results_seconds, 4),
+                'results_peak_mib': round(results_peak, 2),
+                'success_count': success_count,
+                'fail_count': fail_count,
+            }
+            rows.append(row)
+            print(f"{size:>8} {update_seconds:>8.2f}s {row['requests_per_second'] or 0:>9.1f} {db_write_seconds:>8.3f}s "
+                  f"{update_peak:>9.1f} {results_seconds:>8.3f}s {results_peak:>9.1f}"
+                  f"{f'  ({fail_count} failed)' if fail_count else ''}")
+        tracker.close_db() # Release the file before the directory is removed (required on Windows)
+    tracker.close_http_session()
+    server.shutdown()
+    return rows
+
+
+def bench_replay(sizes, runs):
+    """
+    For each roster size: journals `runs` update cycles 15 minutes apart (bodies made by the mock,
+    without any HTTP) and times replaying them into a throwaway database, rollups included.
+    The first cycle's journal is cut in half, like a run killed mid-write that the next run then
+    appends to. Returns False if the replay didn't get every record of the other cycles.
+    """
+    server = start_mock_server()
+    selections = tracker._selections_for(tracker.TRACKED_STATS)
+    print(f"\n--- Journal replay ({runs} update cycles per member) ---")
+    print(f"{'Members':>8} {'Records':>9} {'Journal':>9} {'Replay':>9} {'Records/s':>10}")
+    ok = True
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            journal_path = os.path.join(temp_dir, f"bench_{size}.jsonl.gz")
+            first_fetch = int(time.time()) - runs * 900
+            for cycles in (range(1), range(1, runs)): # One run that crashes, then one for the rest
+                with tracker.ResponseJournal(journal_path) as journal:
+                    for run in cycles:
+                        for user_id in range(1, size + 1):
+                            body = json.dumps(server.user_response(str(user_id), selections))
+                            journal.append(user_id, first_fetch + run * 900, selections, body)
+                        journal.flush() # As update_all_stats() does after each saved batch
+                if cycles.start == 0:
+                    os.truncate(journal_path, os.path.getsize(journal_path) // 2)
+            tracker.set_database_file(os.path.join(temp_dir, f"bench_{size}.db"))
+            tracker.setup_database(verbose=False)
+            _add_synthetic_members(size)
+            replay_seconds, result = _timed(lambda: tracker.replay_journal(journal_path))
+            journal_mib = os.path.getsize(journal_path) / (1024 * 1024)
+            expected = (runs - 1) * size
+            lost = expected - (result.records if result else 0)
+            ok = ok and not lost
+            print(f"{size:>8} {result.records if result else 0:>9} {journal_mib:>7.2f}MiB {replay_seconds:>8.2f}s "
+                  f"{(result.records if result else 0) / replay_seconds:>10,.0f}"
+                  f"{f'  LOST {lost} RECORDS after the crashed run' if lost else ''}")
+        tracker.close_db()
+    server.shutdown()
+    return ok
+
+
+def compare_to_baseline(rows, baseline_path, threshold):
+    """Prints the change against a saved run. Returns False if anything is slower than threshold x baseline."""
+    with open(baseline_path, 'r', encoding='utf-8') as baseline_file:
+        baseline = {row['members']: row for row in json.load(baseline_file)}
+    print(f"\n--- Compared to '{baseline_path}' (regression = more than {threshold:g}x slower) ---")
+    ok = True
+    for row in rows:
+        old = baseline.get(row['members'])
+        if not old:
+            continue
+        for metric in ('update_seconds', 'results_seconds'):
+            ratio = row[metric] / old[metric] if old[metric] else 1.0
+            regressed = ratio > threshold
+            ok = ok and not regressed
+            print(f"{row['members']:>8} {metric:<16} {old[metric]:>9.3f}s -> {row[metric]:>9.3f}s  "
+                  f"x{ratio:.2f}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def _sizes(text):
+    """argparse type for --sizes: comma-separated positive numbers."""
+    try:
+        sizes = [int(part) for part in text.split(',') if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected numbers like 10,100,1000, got '{text}'")
+    if not sizes or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError("sizes must be positive")
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tracker against a local mock Torn API.")
+    parser.add_argument('--suite', choices=('update', 'connections', 'replay', 'all'), default='all')
+    parser.add_argument('--sizes', type=_sizes, default=[10, 100, 1000, 10000],
+                        help="Roster sizes for the update and replay suites (default: 10,100,1000,10000)")
+    parser.add_argument('--keys', type=int, default=None,
+                        help="Share this many API keys between the synthetic members (default: one each)")
+    parser.add_argument('--mock-rate-limit', type=int, default=None,
+                        help="Make the mock enforce this many requests per key per minute (default: off)")
+    parser.add_argument('--requests', type=int, default=200, help="Requests for the connections suite (default: 200)")
+    parser.add_argument('--runs', type=int, default=10, help="Update cycles journaled per member for the replay suite (default: 10)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated server latency in seconds (default: 0)")
+    parser.add_argument('--save', default=None, help="Write the update suite results to this JSON file")
+    parser.add_argument('--compare', default=None, help="Compare the update suite with a file written by --save")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Slowdown factor counted as a regression by --compare (default: 1.25)")
+    args = parser.parse_args()
+
+    if args.suite in ('connections', 'all'):
+        bench_connection_reuse(args.requests, args.latency)
+    if args.suite in ('update', 'all'):
+        rows = bench_update_runs(args.sizes, args.latency, args.keys, args.mock_rate_limit)
+        if args.save:
+            with open(args.save, 'w', encoding='utf-8') as out_file:
+                json.dump(rows, out_file, indent=2)
+            print(f"Saved results to '{args.save}'.")
+        if args.compare and not compare_to_baseline(rows, args.compare, args.threshold):
+            sys.exit(1)
+    if args.suite in ('replay', 'all'):
+        if not bench_replay(args.sizes, args.runs):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Local stand-in for the Torn API, used by benchmark_tracker.py.
+
+Serves /user/<id>?selections=...&key=<key> and /faction/<id>?selections=basic&key=<key>
+over HTTP/1.1 keep-alive, so nothing here ever touches api.torn.com. It can also simulate
+what makes the real API awkward: latency (with jitter), Torn error codes (random or tied to
+particular keys) and Torn's per-key limit of 100 requests per minute.
+
+Run it on its own (python mock_torn_api.py --port 8099) and point API_BASE_URL /
+FACTION_API_URL in Tornstattracker.py at it to try the tracker without real keys.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Messages for the error codes the mock can send (see https://www.torn.com/api.html)
+ERROR_MESSAGES = {
+    1: "Key is empty",
+    2: "Incorrect Key",
+    5: "Too many requests",
+    6: "Incorrect ID",
+    8: "IP block",
+    9: "API disabled",
+    10: "Key owner is in federal jail",
+    13: "The key is temporarily disabled due to owner inactivity",
+    16: "Access level of this key is not high enough",
+    17: "Backend error occurred, please try again",
+    18: "API key has been paused by the owner",
+}
+
+
+class MockTornHandler(BaseHTTPRequestHandler):
+    """Answers Torn-style user and faction requests."""
+    protocol_version = "HTTP/1.1" # Allow keep-alive so pooled clients can reuse connections
+    disable_nagle_algorithm = True # Headers and body go out as separate writes, don't stall on delayed ACKs
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark output clean
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server = self.server
+        server.simulate_latency()
+        key = query.get('key', [''])[0]
+        resource, _, target = url.path.strip('/').partition('/')
+        error_code = server.error_for(key)
+        if error_code:
+            body = {"error": {"code": error_code, "error": ERROR_MESSAGES.get(error_code, "Unknown error")}}
+        elif resource == 'user':
+            body = server.user_response(target, query.get('selections', [''])[0])
+        elif resource == 'faction':
+            body = server.faction_response(target)
+        else:
+            body = {"error": {"code": 4, "error": "Wrong type"}}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200) # Torn reports its errors in the body, with a 200 status
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class MockTornServer(ThreadingHTTPServer):
+    """
+    Threaded mock server that also counts the TCP connections and requests it handled.
+
+    latency / latency_jitter: seconds added to every response (jitter is uniform +/-).
+    rate_limit: requests per key per rolling minute before answering error 5 (None = unlimited).
+    error_rate: fraction of requests answered with a random code from error_codes.
+    key_errors: {api_key: code} for keys that always fail (e.g. {'deadkey': 2}).
+    roster: {user_id: name} returned by the faction endpoint.
+    Every fetch of a user adds one crime to their total, so consecutive updates show progress.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, latency_jitter=0.0, rate_limit=None,
+                 error_rate=0.0, error_codes=(17,), key_errors=None, roster=None, seed=None):
+        super().__init__(address, MockTornHandler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.key_errors = dict(key_errors or {})
+        self.roster = dict(roster or {})
+        self.connections_accepted = 0
+        self.requests_served = 0
+        self.errors_sent = defaultdict(int) # code -> count
+        self._random = random.Random(seed)
+        self._key_history = defaultdict(deque) # api_key -> timestamps of its requests in the last minute
+        self._fetch_counts = defaultdict(int) # user_id -> times fetched
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        self.connections_accepted += 1
+        super().process_request(request, client_address)
+
+    def simulate_latency(self):
+        with self._lock:
+            self.requests_served += 1
+            delay = self.latency + (self._random.uniform(-self.latency_jitter, self.latency_jitter) if self.latency_jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def error_for(self, api_key):
+        """Picks the Torn error code this request gets, or None for a normal answer."""
+        code = None
+        with self._lock:
+            if not api_key:
+                code = 1
+            elif api_key in self.key_errors:
+                code = self.key_errors[api_key]
+            elif self.rate_limit:
+                now = time.monotonic()
+                history = self._key_history[api_key]
+                while history and history[0] <= now - 60:
+                    history.popleft()
+                if len(history) >= self.rate_limit:
+                    code = 5
+                else:
+                    history.append(now)
+            if code is None and self.error_rate and self._random.random() < self.error_rate:
+                code = self._random.choice(self.error_codes)
+            if code:
+                self.errors_sent[code] += 1
+        return code
+
+    def user_response(self, target, selections):
+        """A /user/ response containing the requested selections."""
+        try:
+            user_id = int(target)
+        except ValueError:
+            return {"error": {"code": 6, "error": ERROR_MESSAGES[6]}}
+        with self._lock:
+            self._fetch_counts[user_id] += 1
+            fetches = self._fetch_counts[user_id]
+        body = {"player_id": user_id}
+        wanted = set(selections.split(',')) if selections else {'crimes'}
+        if 'crimes' in wanted:
+            body["criminalrecord"] = {"total": user_id * 10 + fetches}
+        if 'personalstats' in wanted:
+            body["personalstats"] = {"xantaken": user_id % 50 + fetches, "refills": user_id % 20,
+                                     "attackswon": user_id % 300 + fetches, "networth": user_id * 1000}
+        if 'battlestats' in wanted:
+            stats = {"strength": user_id * 4, "defense": user_id * 3, "speed": user_id * 2, "dexterity": user_id}
+            body.update(stats, total=sum(stats.values()))
+        return body
+
+    def faction_response(self, target):
+        """A /faction/ basic response listing the roster."""
+        return {
+            "ID": int(target) if target.isdigit() else 1,
+            "name": "Mock Faction",
+            "members": {str(user_id): {"name": name, "level": 1, "days_in_faction": 1}
+                        for user_id, name in self.roster.items()},
+        }
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/user/"
+
+    @property
+    def faction_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/faction/"
+
+
+def start_mock_server(latency=0.0, **options):
+    """Starts a mock server on a free local port in a background thread and returns it."""
+    server = MockTornServer(latency=latency, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock Torn API.")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every response (default: 0.05)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random +/- seconds on top of --latency")
+    parser.add_argument('--rate-limit', type=int, default=100, help="Requests per key per minute (default: 100, 0 = off)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with error 17")
+    parser.add_argument('--roster-size', type=int, default=0, help="Members listed by the faction endpoint")
+    args = parser.parse_args()
+    server = MockTornServer(('127.0.0.1', args.port), latency=args.latency, latency_jitter=args.jitter,
+                            rate_limit=args.rate_limit or None, error_rate=args.error_rate,
+                            roster={user_id: f"Player{user_id}" for user_id in range(1, args.roster_size + 1)})
+    print(f"Mock Torn API on {server.base_url} and {server.faction_url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()